@@ -0,0 +1,53 @@
+"""
+Throughput of the Sender outbox: appends and drains per second for every
+fsync policy.
+
+    PYTHONPATH=. python benchmarks/outbox.py [--records N] [--size BYTES]
+"""
+
+import argparse
+import shutil
+import tempfile
+import time
+
+from weavelib.messaging.outbox import Outbox
+from weavelib.messaging.outbox import FSYNC_ALWAYS, FSYNC_SEGMENT, FSYNC_NEVER
+
+
+def run(fsync, records, size):
+    path = tempfile.mkdtemp(prefix="outbox-bench-")
+    try:
+        outbox = Outbox(path, fsync=fsync)
+        payload = b"x" * size
+
+        start = time.perf_counter()
+        for _ in range(records):
+            outbox.append(payload)
+        append_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        drained = outbox.drain(lambda data: None)
+        drain_time = time.perf_counter() - start
+        outbox.close()
+    finally:
+        shutil.rmtree(path)
+
+    assert drained == records
+    return records / append_time, records / drain_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("--records", type=int, default=20000)
+    parser.add_argument("--size", type=int, default=200)
+    args = parser.parse_args()
+
+    print("{} records of {} bytes".format(args.records, args.size))
+    for fsync in (FSYNC_NEVER, FSYNC_SEGMENT, FSYNC_ALWAYS):
+        appends, drains = run(fsync, args.records, args.size)
+        print("{:>8}: {:>10.0f} appends/s {:>10.0f} drained/s".format(
+            fsync, appends, drains))
+
+
+if __name__ == '__main__':
+    main()
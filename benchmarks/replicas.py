@@ -0,0 +1,131 @@
+"""
+Throughput of an RPC with a CPU-bound handler, served by 1 to N instances:
+the primary RPCServer and N - 1 replicas in a ReplicaPool. Starts a
+messaging server of its own, so needs WeaveServer (see dev-requirements.txt).
+
+    PYTHONPATH=. python benchmarks/replicas.py [--calls N] [--work N]
+"""
+
+import argparse
+import os
+import time
+from concurrent.futures import wait
+from uuid import uuid4
+
+from messaging.service import CoreService
+
+from weavelib.messaging import WeaveConnection
+from weavelib.rpc import ArgParameter, ReplicaPool, RPCClient, RPCServer
+from weavelib.rpc import ServerAPI, find_rpc
+from weavelib.services import BackgroundThreadServiceStart, BaseService
+from weavelib.services import MessagingEnabled
+
+
+MESSAGING_PLUGIN_URL = "https://github.com/HomeWeave/WeaveServer.git"
+
+
+class MessagingService(BackgroundThreadServiceStart, CoreService):
+    def __init__(self):
+        self.token = str(uuid4())
+        super(MessagingService, self).__init__(auth_token=self.token,
+                                               started_token="bench")
+
+
+class EnvService(MessagingEnabled):
+    def __init__(self, auth_token, conn):
+        super(EnvService, self).__init__(auth_token=auth_token, conn=conn)
+
+
+def work(num):
+    return sum(x * x for x in range(num))
+
+
+class BenchService(MessagingEnabled, BaseService):
+    def __init__(self, conn, token, rpc_info=None):
+        super(BenchService, self).__init__(auth_token=token, conn=conn)
+        apis = [
+            ServerAPI("work", "desc", [ArgParameter("num", "d", int)], work),
+        ]
+        self.rpc_server = RPCServer("bench", "desc", apis, self,
+                                    replica_of=rpc_info)
+
+
+def replica_server(conn, token, rpc_info):
+    return BenchService(conn, token, rpc_info).rpc_server
+
+
+def start_messaging():
+    """ Returns the running messaging service and its auth token. """
+    service = MessagingService()
+    service.service_start()
+    service.wait_for_start(15)
+    return service, service.token
+
+
+def register_plugin(conn, env_token):
+    rpc_info = find_rpc(EnvService(env_token, conn), MESSAGING_PLUGIN_URL,
+                        "app_manager")
+    appmgr_client = RPCClient(conn, rpc_info, env_token)
+    appmgr_client.start()
+    try:
+        return appmgr_client["register_plugin"]("bench", "bench",
+                                                _block=True)
+    finally:
+        appmgr_client.stop()
+
+
+def measure(client, calls, num):
+    # Warm up, so that every instance is up and connected.
+    wait([client["work"](num, _future=True) for _ in range(calls // 10)])
+
+    start = time.perf_counter()
+    futures = [client["work"](num, _future=True) for _ in range(calls)]
+    for future in futures:
+        future.result()
+    return calls / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("--calls", type=int, default=500)
+    parser.add_argument("--work", type=int, default=200000,
+                        help="Size of the loop in the handler.")
+    parser.add_argument("--max-instances", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    messaging, env_token = start_messaging()
+    conn = WeaveConnection.local()
+    conn.connect()
+    token = register_plugin(conn, env_token)
+
+    primary = BenchService(conn, token)
+    primary.rpc_server.start()
+    client = RPCClient(conn, primary.rpc_server.info_message, token)
+    client.start()
+
+    try:
+        print("{} calls, work={}".format(args.calls, args.work))
+        base = None
+        for instances in range(1, args.max_instances + 1):
+            pool = None
+            if instances > 1:
+                pool = ReplicaPool(replica_server, instances - 1)
+                pool.start(primary.rpc_server)
+            try:
+                rate = measure(client, args.calls, args.work)
+            finally:
+                if pool is not None:
+                    pool.stop()
+
+            base = base or rate
+            print("{:>3} instances: {:>8.1f} calls/s ({:.2f}x)".format(
+                instances, rate, rate / base))
+    finally:
+        client.stop()
+        primary.rpc_server.stop()
+        conn.close()
+        messaging.service_stop()
+
+
+if __name__ == '__main__':
+    main()
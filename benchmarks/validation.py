@@ -0,0 +1,59 @@
+"""
+Time taken to validate a call: the specialized checkers of API.validate_call
+against a (cached) jsonschema validator for the same request schema.
+
+    PYTHONPATH=. python benchmarks/validation.py [--calls N]
+"""
+
+import argparse
+import time
+
+from jsonschema import Draft4Validator
+
+from weavelib.rpc import ArgParameter, KeywordParameter, ListOf, OneOf, Type
+from weavelib.rpc.api import API
+
+
+def build_api():
+    return API("bench", "desc", [
+        ArgParameter("name", "d", str),
+        ArgParameter("count", "d", int),
+        ArgParameter("flag", "d", bool),
+        KeywordParameter("color", "d", OneOf("red", "green", "blue")),
+        KeywordParameter("tags", "d", ListOf(Type(str))),
+    ])
+
+
+def timed(func, calls):
+    start = time.perf_counter()
+    for _ in range(calls):
+        func()
+    return (time.perf_counter() - start) / calls * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("--calls", type=int, default=20000)
+    args = parser.parse_args()
+
+    api = build_api()
+    call_args = ("hello", 5, True)
+    call_kwargs = {"color": "green", "tags": ["a", "b", "c"]}
+    obj = api.validate_call(*call_args, **call_kwargs)
+    validator = Draft4Validator(api.schema)
+    assert validator.is_valid(obj)
+
+    results = [
+        ("jsonschema", timed(lambda: validator.validate(obj), args.calls)),
+        ("checkers", timed(lambda: api.checker(call_args, call_kwargs),
+                           args.calls)),
+        ("validate_call", timed(lambda: api.validate_call(*call_args,
+                                                          **call_kwargs),
+                                args.calls)),
+    ]
+    for name, micros in results:
+        print("{:>14}: {:>8.2f}us per call".format(name, micros))
+
+
+if __name__ == '__main__':
+    main()
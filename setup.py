@@ -10,6 +10,7 @@ setup(
     license='MIT',
     description='Library to interact with Weave Server',
     long_description=open('README.md').read(),
+    python_requires='>=3.7',
     install_requires=[
         'jsonschema',
         'netifaces',
@@ -0,0 +1,68 @@
+import io
+
+import pytest
+
+from weavelib.exceptions import ProtocolError
+from weavelib.messaging import Message, Sender, Outbox
+from weavelib.messaging import read_message, serialize_message
+from weavelib.messaging.messaging import write_message
+
+
+class FakeConnection(object):
+    def __init__(self, active=True):
+        self.active = active
+        self.messages = []
+
+    def write_message(self, msg, session_id):
+        if not self.active:
+            raise IOError("Connection closed.")
+        self.messages.append(msg.task)
+
+
+def round_trip(msg):
+    out = io.BytesIO()
+    write_message(out, msg)
+    return read_message(io.BytesIO(out.getvalue()))
+
+
+class TestAttachments(object):
+    def test_round_trip(self):
+        task = {"args": [b"\x00\xff\n\n", "text"],
+                "kwargs": {"a": [b"", bytearray(b"xyz")]}}
+        msg = Message("push", task)
+        msg.headers["C"] = "/q"
+
+        res = round_trip(msg)
+        assert res.task == {"args": [b"\x00\xff\n\n", "text"],
+                            "kwargs": {"a": [b"", b"xyz"]}}
+        assert res.headers == {"C": "/q"}
+
+    def test_no_attachments(self):
+        msg = Message("push", {"a": "b"})
+        assert "ATT" not in serialize_message(msg)
+        assert round_trip(msg).task == {"a": "b"}
+
+    def test_not_serializable(self):
+        with pytest.raises(TypeError):
+            serialize_message(Message("push", {"a": object()}))
+
+    def test_truncated(self):
+        out = io.BytesIO()
+        write_message(out, Message("push", [b"hello"]))
+        with pytest.raises(ProtocolError):
+            read_message(io.BytesIO(out.getvalue()[:-1]))
+
+    def test_bad_reference(self):
+        data = b'OP push\nMSG {"$attachment": 1}\nATT 1\n\nx'
+        with pytest.raises(ProtocolError):
+            read_message(io.BytesIO(data))
+
+    def test_outbox(self, tmpdir):
+        conn = FakeConnection(active=False)
+        sender = Sender(conn, "/queue", outbox=Outbox(str(tmpdir)))
+        sender.send({"data": b"\x00\x01"})
+        sender.send({"data": b"\x02"})
+
+        conn.active = True
+        sender.drain()
+        assert conn.messages == [{"data": b"\x00\x01"}, {"data": b"\x02"}]
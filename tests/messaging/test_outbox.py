@@ -0,0 +1,141 @@
+import os
+
+import pytest
+
+from weavelib.exceptions import BadArguments, OutboxFull
+from weavelib.messaging import Sender
+from weavelib.messaging.outbox import Outbox, FSYNC_ALWAYS
+
+
+class FakeConnection(object):
+    def __init__(self, active=True):
+        self.active = active
+        self.messages = []
+
+    def write_message(self, msg, session_id):
+        if not self.active:
+            raise IOError("Connection closed.")
+        self.messages.append((msg.task, msg.headers["C"]))
+
+
+class TestOutbox(object):
+    def test_drain_in_order(self, tmpdir):
+        outbox = Outbox(str(tmpdir))
+        for i in range(10):
+            outbox.append("msg{}".format(i))
+
+        assert len(outbox) == 10
+        assert outbox.peek() == b"msg0"
+
+        res = []
+        assert outbox.drain(res.append) == 10
+        assert res == [("msg{}".format(i)).encode() for i in range(10)]
+        assert len(outbox) == 0
+        assert outbox.peek() is None
+
+    def test_survives_reopen(self, tmpdir):
+        outbox = Outbox(str(tmpdir), fsync=FSYNC_ALWAYS)
+        for i in range(5):
+            outbox.append("msg{}".format(i))
+
+        res = []
+
+        def consume_two(data):
+            if len(res) == 2:
+                raise IOError()
+            res.append(data)
+
+        with pytest.raises(IOError):
+            outbox.drain(consume_two)
+        outbox.close()
+
+        outbox = Outbox(str(tmpdir))
+        assert len(outbox) == 3
+        outbox.drain(res.append)
+        assert res == [("msg{}".format(i)).encode() for i in range(5)]
+
+    def test_segment_roll_and_cleanup(self, tmpdir):
+        outbox = Outbox(str(tmpdir), segment_size=64, max_bytes=64 * 10)
+        for i in range(20):
+            outbox.append("message-{:04d}".format(i))
+
+        segments = [x for x in os.listdir(str(tmpdir)) if x.endswith(".seg")]
+        assert len(segments) > 1
+
+        res = []
+        outbox.drain(res.append)
+        assert len(res) == 20
+
+        segments = [x for x in os.listdir(str(tmpdir)) if x.endswith(".seg")]
+        assert len(segments) == 1
+
+    def test_size_cap(self, tmpdir):
+        outbox = Outbox(str(tmpdir), segment_size=64, max_bytes=128)
+        with pytest.raises(BadArguments):
+            outbox.append("x" * 100)
+        with pytest.raises(BadArguments):
+            outbox.append(b"")
+        assert len(outbox) == 0
+
+        with pytest.raises(OutboxFull):
+            for _ in range(100):
+                outbox.append("x" * 20)
+
+    def test_truncated_record_ignored(self, tmpdir):
+        outbox = Outbox(str(tmpdir), segment_size=64, max_bytes=64)
+        outbox.append("good")
+        outbox.append("torn")
+        outbox.close()
+
+        path = os.path.join(str(tmpdir), [x for x in os.listdir(str(tmpdir))
+                                          if x.endswith(".seg")][0])
+        with open(path, "r+b") as out:
+            out.seek(8 + 4 + 8)
+            out.write(b"xx")
+
+        outbox = Outbox(str(tmpdir), segment_size=64, max_bytes=64)
+        assert len(outbox) == 1
+        assert outbox.peek() == b"good"
+
+
+class TestSenderOutbox(object):
+    def test_buffer_while_disconnected(self, tmpdir):
+        conn = FakeConnection(active=False)
+        sender = Sender(conn, "/queue", outbox=Outbox(str(tmpdir)))
+        sender.start()
+
+        for i in range(3):
+            sender.send({"i": i})
+
+        assert conn.messages == []
+        assert len(sender.outbox) == 3
+
+        conn.active = True
+        sender.send({"i": 3})
+
+        assert conn.messages == [({"i": i}, "/queue") for i in range(4)]
+        assert len(sender.outbox) == 0
+
+    def test_drain_on_start(self, tmpdir):
+        conn = FakeConnection(active=False)
+        sender = Sender(conn, "/queue", outbox=Outbox(str(tmpdir)))
+        sender.send({"a": 1})
+        sender.outbox.close()
+
+        conn = FakeConnection()
+        sender = Sender(conn, "/queue", outbox=Outbox(str(tmpdir)))
+        sender.start()
+        assert conn.messages == [({"a": 1}, "/queue")]
+
+    def test_rebind(self, tmpdir):
+        conn = FakeConnection(active=False)
+        sender = Sender(conn, "/queue", outbox=Outbox(str(tmpdir)))
+        sender.send({"a": 1})
+        sender.send({"a": 2})
+
+        new_conn = FakeConnection()
+        sender.rebind(new_conn)
+        sender.send({"a": 3})
+        assert new_conn.messages == [({"a": i}, "/queue") for i in (1, 2, 3)]
+        assert conn.messages == []
+        assert len(sender.outbox) == 0
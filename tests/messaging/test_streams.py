@@ -0,0 +1,94 @@
+import io
+from collections import deque
+
+import pytest
+
+from weavelib.exceptions import ProtocolError
+from weavelib.messaging import Message, Sender, Receiver
+from weavelib.messaging.messaging import iter_chunks
+
+
+class LoopbackConnection(object):
+    def __init__(self):
+        self.active = True
+        self.messages = deque()
+
+    def write_message(self, msg, session_id):
+        self.messages.append(Message("inform", msg.task))
+
+    def read_message(self, msg, session_id):
+        return self.messages.popleft()
+
+
+class TestIterChunks(object):
+    def test_bytes(self):
+        assert list(iter_chunks(b"abcdefg", 3)) == [b"abc", b"def", b"g"]
+
+    def test_file(self):
+        assert list(iter_chunks(io.BytesIO(b"abcdefg"), 4)) == [b"abcd",
+                                                               b"efg"]
+
+    def test_bytes_like(self):
+        expected = [b"abc", b"def", b"g"]
+        assert list(iter_chunks(bytearray(b"abcdefg"), 3)) == expected
+        assert list(iter_chunks(memoryview(b"abcdefg"), 3)) == expected
+        assert list(iter_chunks([bytearray(b"ab"), memoryview(b"c")], 3)) == \
+            [b"ab", b"c"]
+
+    def test_iterable(self):
+        assert list(iter_chunks([b"abcde", b"f"], 2)) == [b"ab", b"cd", b"e",
+                                                          b"f"]
+
+
+class TestStreams(object):
+    def test_stream_roundtrip(self):
+        conn = LoopbackConnection()
+        payload = bytes(range(256)) * 100
+        Sender(conn, "/q").send_stream(io.BytesIO(payload), chunk_size=1000)
+
+        assert len(conn.messages) == 27
+
+        chunks = list(Receiver(conn, "/q").receive_stream())
+        assert all(len(x) <= 1000 for x in chunks)
+        assert b"".join(chunks) == payload
+        assert not conn.messages
+
+    def test_stream_to_file(self):
+        conn = LoopbackConnection()
+        Sender(conn, "/q").send_stream(b"hello world", chunk_size=3)
+
+        out = io.BytesIO()
+        assert Receiver(conn, "/q").receive_stream(out) == 11
+        assert out.getvalue() == b"hello world"
+
+    def test_stream_bytearray(self):
+        conn = LoopbackConnection()
+        Sender(conn, "/q").send_stream(bytearray(b"abc"))
+        assert list(Receiver(conn, "/q").receive_stream()) == [b"abc"]
+
+    def test_empty_stream(self):
+        conn = LoopbackConnection()
+        Sender(conn, "/q").send_stream(b"")
+        assert list(Receiver(conn, "/q").receive_stream()) == []
+
+    def test_out_of_sequence(self):
+        conn = LoopbackConnection()
+        Sender(conn, "/q").send_stream(b"hello world", chunk_size=3)
+        conn.messages.remove(conn.messages[1])
+
+        with pytest.raises(ProtocolError):
+            list(Receiver(conn, "/q").receive_stream())
+
+    def test_non_stream_message(self):
+        conn = LoopbackConnection()
+        Sender(conn, "/q").send({"a": 1})
+
+        with pytest.raises(ProtocolError):
+            list(Receiver(conn, "/q").receive_stream())
+
+    def test_bad_chunk(self):
+        conn = LoopbackConnection()
+        Sender(conn, "/q").send({"stream": "s", "seq": 0, "data": "aGk="})
+
+        with pytest.raises(ProtocolError):
+            list(Receiver(conn, "/q").receive_stream())
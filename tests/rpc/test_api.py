@@ -1,10 +1,12 @@
+from enum import Enum, IntEnum
+
 import pytest
-from jsonschema import validate
+from jsonschema import validate, Draft4Validator
 
 from weavelib.exceptions import BadArguments
 from weavelib.rpc import ArgParameter, KeywordParameter, JsonSchema, OneOf
-from weavelib.rpc import Exactly, ListOf, Type
-from weavelib.rpc.api import API
+from weavelib.rpc import Exactly, ListOf, Type, Bytes
+from weavelib.rpc.api import API, BaseSchema, fingerprint
 
 
 class TestParameter(object):
@@ -42,6 +44,64 @@ class TestParameter(object):
             ArgParameter.from_info({})
 
 
+class Letter(str, Enum):
+    A = "a"
+
+
+class Number(IntEnum):
+    ONE = 1
+
+
+class TestCheckers(object):
+    VALUES = [True, False, 0, 1, 1.0, 2.5, "", "1", "a", None, [], [1],
+              [1, 2], [True], ["a", "b"], {}, {"a": "b"}, {"a": 1},
+              Letter.A, Number.ONE, [Letter.A]]
+
+    SCHEMAS = [
+        Type(str), Type(int), Type(float), Type(bool),
+        Exactly(1), Exactly(True), Exactly("a"), Exactly({"a": "b"}),
+        Exactly([1, 2]),
+        OneOf(1, "a", True), OneOf({"a": "b"}, [1], 2.5), OneOf(0, False),
+        OneOf(Letter.A, Number.ONE),
+        ListOf(Type(int)), ListOf(OneOf("a", "b")), ListOf(ListOf(Type(str))),
+        JsonSchema({"type": "object"}),
+    ]
+
+    @pytest.mark.parametrize("schema", SCHEMAS)
+    def test_same_as_json_schema(self, schema):
+        validator = Draft4Validator(schema.json_schema())
+        reconstructed = BaseSchema.from_json_schema(schema.json_schema())
+
+        for value in self.VALUES:
+            expected = validator.is_valid(value)
+            assert schema.checker()(value) == expected, value
+            assert reconstructed.checker()(value) == expected, value
+
+    def test_from_json_schema(self):
+        assert isinstance(BaseSchema.from_json_schema({"type": "string"}),
+                          Type)
+        assert isinstance(BaseSchema.from_json_schema(
+            OneOf(1, 2).json_schema()), OneOf)
+        assert isinstance(BaseSchema.from_json_schema(
+            ListOf(Exactly(1)).json_schema()), ListOf)
+        assert isinstance(BaseSchema.from_json_schema(
+            {"type": "string", "maxLength": 5}), JsonSchema)
+        assert isinstance(BaseSchema.from_json_schema(
+            Bytes().json_schema()), Bytes)
+
+    def test_bytes(self):
+        api = API("name", "desc", [ArgParameter("a1", "d1", bytes),
+                                   KeywordParameter("a2", "d2", Bytes())])
+        api.validate_call(b"\x00", a2=bytearray(b"x"))
+        with pytest.raises(BadArguments):
+            api.validate_call("str", a2=b"")
+
+        api = API.from_info(api.info)
+        api.validate_call(b"", a2=b"")
+        with pytest.raises(BadArguments):
+            api.validate_call(b"", a2="str")
+
+
 class TestAPI(object):
     def test_validate_schema_without_args(self):
         api = API("name", "desc", [])
@@ -122,6 +182,59 @@ class TestAPI(object):
             "kwargs": {"a2": 5, "a3": False}
         }
 
+    def test_schema_cached(self):
+        api = API("name", "desc", [ArgParameter("a1", "d1", str)])
+
+        assert api.schema is api.schema
+        assert api.checker is api.checker
+
+        checker = api.checker
+        api.args.append(ArgParameter("a2", "d2", int))
+        api.invalidate_schema()
+
+        assert api.checker is not checker
+        api.validate_call("a", 1)
+        with pytest.raises(BadArguments):
+            api.validate_call("a")
+
+    def test_fingerprint(self):
+        api = API("name", "desc", [ArgParameter("a1", "d1", str)])
+        info = api.info
+
+        assert fingerprint(info) == fingerprint(api.info)
+        info["fingerprint"] = fingerprint(info)
+        assert fingerprint(info) == info["fingerprint"]
+
+        api.args.append(ArgParameter("a2", "d2", int))
+        api.invalidate_schema()
+        assert fingerprint(api.info) != info["fingerprint"]
+
+    def test_checker_matches_request_schema(self):
+        apis = [
+            API("name", "desc", []),
+            API("name", "desc", [ArgParameter("a1", "d1", str)]),
+            API("name", "desc", [KeywordParameter("a2", "d2", int)]),
+            API("name", "desc", [
+                ArgParameter("a1", "d1", str),
+                KeywordParameter("a2", "d2", ListOf(Type(int))),
+            ]),
+        ]
+        calls = [
+            ((), {}), (("a",), {}), (("a", "b"), {}), ((1,), {}),
+            ((), {"a2": 1}), (("a",), {"a2": 1}), (("a",), {"a2": [1]}),
+            (("a",), {"a2": [1], "a3": 2}), ((), {"a3": 1}),
+        ]
+
+        for api in apis:
+            validator = Draft4Validator(api.schema)
+            for args, kwargs in calls:
+                obj = {"command": "name", "id": "x"}
+                if args:
+                    obj["args"] = list(args)
+                if kwargs:
+                    obj["kwargs"] = kwargs
+                assert api.checker(args, kwargs) == validator.is_valid(obj)
+
     def test_api_reconstruct(self):
         api = API("name", "desc", [
             KeywordParameter("a2", "d2", int),
@@ -139,6 +252,24 @@ class TestAPI(object):
         with pytest.raises(BadArguments):
             API.from_info({})
 
+    def test_dynamic_schema_memoized(self):
+        calls = []
+
+        def schema():
+            calls.append(1)
+            return OneOf(*"ab"[:len(calls)])
+
+        api = API("name", "desc", [ArgParameter("a1", "d1", schema)])
+        api.validate_call("a")
+        with pytest.raises(BadArguments):
+            api.validate_call("b")
+        assert api.info["args"][0]["schema"] == OneOf("a").json_schema()
+        assert len(calls) == 1
+
+        api.invalidate_schema()
+        api.validate_call("b")
+        assert len(calls) == 2
+
     def test_validate_schema_with_callable(self):
         count = 0
         def schema():
@@ -159,6 +290,7 @@ class TestAPI(object):
         api.validate_call({"h": [1, 2, "hi", {"a": "b"}]})
 
         count = 1
+        api.invalidate_schema()
         with pytest.raises(BadArguments):
             api.validate_call({"h": [1, 2, "hi", {"a": "b"}]})
         api.validate_call({"a": "b"})
@@ -166,17 +298,20 @@ class TestAPI(object):
         api.validate_call([1, 2])
 
         count = 2
+        api.invalidate_schema()
         with pytest.raises(BadArguments):
           api.validate_call([1, 2])
         api.validate_call("test")
 
         count = 3
+        api.invalidate_schema()
         with pytest.raises(BadArguments):
             api.validate_call("test")
         api.validate_call([1])
         api.validate_call([1]*10)
 
         count = 4
+        api.invalidate_schema()
         with pytest.raises(BadArguments):
             api.validate_call([1])
         api.validate_call(5)
@@ -0,0 +1,79 @@
+import time
+
+import pytest
+
+from weavelib.exceptions import BadArguments
+from weavelib.rpc import ArgParameter, CachePolicy, ClientAPI, ServerAPI
+from weavelib.rpc.cache import LRUCache, cache_key
+
+
+class TestCachePolicy(object):
+    def test_bad_policy(self):
+        with pytest.raises(BadArguments):
+            CachePolicy(0)
+
+        with pytest.raises(BadArguments):
+            CachePolicy(10, max_entries=0)
+
+    def test_info(self):
+        policy = CachePolicy.from_info(CachePolicy(10, 5).info)
+        assert (policy.ttl, policy.max_entries) == (10, 5)
+
+        with pytest.raises(BadArguments):
+            CachePolicy.from_info({"ttl": 10})
+
+    def test_api_info(self):
+        api = ServerAPI("name", "desc", [ArgParameter("a", "b", int)],
+                        lambda x: x, cache_policy=CachePolicy(10, 5))
+        assert api.info["cache"] == {"ttl": 10, "max_entries": 5}
+        assert "cache" not in api.schema["properties"]
+
+        client_api = ClientAPI.from_info(api.info, None)
+        assert client_api.cache_policy.info == api.cache_policy.info
+
+        api = ServerAPI("name", "desc", [], lambda: None)
+        assert "cache" not in api.info
+        assert ClientAPI.from_info(api.info, None).result_cache is None
+
+
+class TestLRUCache(object):
+    def test_cache_key(self):
+        assert cache_key({"args": [1], "kwargs": {"a": 1, "b": 2}}) == \
+            cache_key({"id": "x", "kwargs": {"b": 2, "a": 1}, "args": [1]})
+        assert cache_key({"args": [1]}) != cache_key({"args": [2]})
+
+    def test_get_put(self):
+        cache = LRUCache(CachePolicy(10))
+        assert cache.get("a") == (False, None)
+
+        cache.put("a", None)
+        assert cache.get("a") == (True, None)
+
+    def test_expiry(self):
+        cache = LRUCache(CachePolicy(0.1))
+        cache.put("a", 1)
+        time.sleep(0.2)
+        assert cache.get("a") == (False, None)
+        assert len(cache) == 0
+
+    def test_eviction(self):
+        cache = LRUCache(CachePolicy(10, max_entries=2))
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.get("a")
+        cache.put("c", 3)
+
+        assert cache.get("a") == (True, 1)
+        assert cache.get("b") == (False, None)
+        assert cache.get("c") == (True, 3)
+
+    def test_stale_put(self):
+        cache = LRUCache(CachePolicy(10))
+        generation = cache.generation
+        cache.clear()
+
+        cache.put("a", 1, generation)
+        assert cache.get("a") == (False, None)
+
+        cache.put("a", 1, cache.generation)
+        assert cache.get("a") == (True, 1)
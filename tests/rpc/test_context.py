@@ -0,0 +1,35 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from weavelib.rpc import RequestContext, get_request_context
+from weavelib.rpc import propagate_context
+
+
+class TestRequestContext(object):
+    def test_run(self):
+        context = RequestContext({"app_name": "x"}, "id", 0)
+        assert context.run(get_request_context) is context
+        assert get_request_context() is None
+
+    def test_run_coroutine(self):
+        context = RequestContext(None, "id", 0)
+
+        async def get_context():
+            task = asyncio.create_task(asyncio.sleep(0, get_request_context()))
+            return await task
+
+        assert asyncio.run(context.run_coroutine(get_context)) is context
+
+    def test_propagate_context(self):
+        context = RequestContext(None, "id", 0)
+
+        def submit():
+            with ThreadPoolExecutor(2) as executor:
+                futures = [executor.submit(propagate_context(f))
+                           for f in (get_request_context, get_request_context)]
+                return executor.submit(get_request_context).result(), \
+                    [x.result() for x in futures]
+
+        plain, propagated = context.run(submit)
+        assert plain is None
+        assert propagated == [context, context]
@@ -0,0 +1,122 @@
+from queue import Queue
+
+from weavelib.messaging import Message
+from weavelib.messaging.messaging import MessageWaiter
+from weavelib.rpc.demux import ResponseDemux, demuxes, get_demux
+from weavelib.rpc.pending import PendingCalls
+
+
+class FakeConnection(object):
+    def __init__(self):
+        self.active = True
+        self.readers = {}
+        self.listeners = []
+        self.pops = Queue()
+
+    def add_reader(self, session_id, callback):
+        self.readers[session_id] = callback
+
+    def add_close_listener(self, callback):
+        self.listeners.append(callback)
+
+    def remove_reader(self, session_id):
+        self.readers.pop(session_id)
+
+    def send_internal(self, msg):
+        self.pops.put(msg)
+
+    def respond(self, pop, task):
+        self.readers[pop.headers["SESS"]](Message("inform", task))
+
+    def reply(self, pop, res, err=None):
+        msg = Message("result")
+        msg.headers["RES"] = res
+        if err:
+            msg.headers["ERRMSG"] = err
+        self.readers[pop.headers["SESS"]](msg)
+
+    def close(self):
+        self.active = False
+        for callback in self.readers.values():
+            callback(MessageWaiter.CONNECTION_CLOSED)
+        for callback in self.listeners:
+            callback()
+
+
+class FakeClient(object):
+    def __init__(self, *msg_ids):
+        self.pending = PendingCalls()
+        self.responses = Queue()
+        for msg_id in msg_ids:
+            self.pending.add(msg_id, self.responses.put)
+
+    def on_rpc_message(self, msg, headers):
+        self.responses.put(msg)
+
+
+class TestResponseDemux(object):
+    def test_route_by_id(self):
+        conn = FakeConnection()
+        demux = ResponseDemux(conn)
+        client1, client2 = FakeClient("1"), FakeClient("2")
+        cookie = demux.subscribe("/q", client1)
+        assert demux.subscribe("/q", client2) == cookie
+
+        pop = conn.pops.get(timeout=5)
+        assert conn.pops.empty()
+        assert pop.headers["C"] == "/q"
+        assert pop.headers["COOKIE"] == cookie
+
+        conn.respond(pop, {"id": "2", "result": 1})
+        assert client2.responses.get(timeout=5) == {"id": "2", "result": 1}
+
+        pop = conn.pops.get(timeout=5)
+        conn.respond(pop, {"invalidate": ["api"]})
+        assert client1.responses.get(timeout=5) == {"invalidate": ["api"]}
+        assert client2.responses.get(timeout=5) == {"invalidate": ["api"]}
+
+    def test_new_cookie_after_unsubscribe(self):
+        conn = FakeConnection()
+        demux = ResponseDemux(conn)
+        client = FakeClient()
+        cookie = demux.subscribe("/q", client)
+        demux.unsubscribe("/q", client)
+        assert not conn.readers
+
+        assert demux.subscribe("/q", client) != cookie
+        assert len(conn.readers) == 1
+
+    def test_pop_after_result(self):
+        conn = FakeConnection()
+        demux = ResponseDemux(conn)
+        client = FakeClient("1")
+        demux.subscribe("/q", client)
+
+        conn.reply(conn.pops.get(timeout=5), "OK")
+        conn.respond(conn.pops.get(timeout=5), {"id": "1", "result": 1})
+        assert client.responses.get(timeout=5) == {"id": "1", "result": 1}
+
+    def test_fail_pending_on_error(self):
+        conn = FakeConnection()
+        demux = ResponseDemux(conn)
+        client = FakeClient("1", "2")
+        demux.subscribe("/q", client)
+
+        conn.reply(conn.pops.get(timeout=5), "ObjectNotFound", "No queue.")
+        responses = [client.responses.get(timeout=5) for _ in range(2)]
+        assert {x["id"] for x in responses} == {"1", "2"}
+        assert {x["error_name"] for x in responses} == {"ObjectNotFound"}
+
+    def test_close(self):
+        conn = FakeConnection()
+        demux = get_demux(conn)
+        client = FakeClient("1")
+        demux.subscribe("/q", client)
+        assert conn in demuxes
+
+        conn.close()
+        response = client.responses.get(timeout=5)
+        assert response["error_name"] == "ObjectClosed"
+        assert conn not in demuxes
+        demux.thread.join(5)
+        assert not demux.thread.is_alive()
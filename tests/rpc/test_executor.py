@@ -0,0 +1,77 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event
+
+import pytest
+
+from weavelib.rpc.executor import APIExecutor
+
+
+class TestAPIExecutor(object):
+    def setup_method(self):
+        self.pool = ThreadPoolExecutor(10)
+
+    def teardown_method(self):
+        self.pool.shutdown()
+
+    def test_result_and_exception(self):
+        executor = APIExecutor(self.pool.submit)
+
+        assert executor.submit(lambda x: x * 2, 4).result() == 8
+
+        def fail():
+            raise ValueError("fail")
+
+        with pytest.raises(ValueError):
+            executor.submit(fail).result()
+
+        assert executor.stats()["completed"] == 2
+        assert executor.stats()["running"] == 0
+
+    def test_waiting_and_run_time(self):
+        executor = APIExecutor(self.pool.submit, max_concurrency=1)
+        futures = [executor.submit(time.sleep, 0.2) for _ in range(3)]
+        time.sleep(0.1)
+        assert executor.waiting == 2
+
+        for future in futures:
+            future.result()
+        assert executor.waiting == 0
+        assert 0.2 <= executor.stats()["avg_run_time"] < 0.4
+
+        executor.record_rejection()
+        assert executor.stats()["rejected"] == 1
+
+    def test_submit_failure(self):
+        def submit(fn, *args, **kwargs):
+            raise ValueError("bad")
+
+        with pytest.raises(ValueError):
+            APIExecutor(submit).submit(lambda: None).result()
+
+    def test_concurrency_limit(self):
+        executor = APIExecutor(self.pool.submit, max_concurrency=2)
+        event = Event()
+        running = []
+
+        def blocked(index):
+            running.append(index)
+            event.wait()
+            return index
+
+        futures = [executor.submit(blocked, i) for i in range(6)]
+        time.sleep(0.2)
+
+        assert sorted(running) == [0, 1]
+        assert executor.stats()["queue_depth"] == 4
+        assert executor.stats()["running"] == 2
+
+        event.set()
+        assert [x.result() for x in futures] == list(range(6))
+        assert sorted(running) == list(range(6))
+
+        stats = executor.stats()
+        assert stats["queue_depth"] == 0
+        assert stats["running"] == 0
+        assert stats["completed"] == 6
+        assert stats["max_wait"] >= 0.2
@@ -0,0 +1,49 @@
+from weavelib.rpc.metrics import APIMetrics, Histogram
+
+
+class TestHistogram(object):
+    def test_empty(self):
+        snapshot = Histogram(1).snapshot()
+        assert snapshot["count"] == 0
+        assert snapshot["p50"] is None
+        assert snapshot["mean"] is None
+
+    def test_percentiles(self):
+        histogram = Histogram(1, factor=2, num_buckets=10)
+        for value in range(1, 101):
+            histogram.record(value)
+
+        snapshot = histogram.snapshot()
+        assert snapshot["count"] == 100
+        assert snapshot["mean"] == 50.5
+        assert (snapshot["min"], snapshot["max"]) == (1, 100)
+
+        # Estimates are the upper bounds of buckets: ..., 32, 64, 128.
+        assert snapshot["p50"] == 64
+        assert snapshot["p90"] == 100
+        assert histogram.percentile(10) == 16
+
+    def test_overflow(self):
+        histogram = Histogram(1, num_buckets=2)
+        histogram.record(1000)
+        assert histogram.percentile(99) == 1000
+
+
+class TestAPIMetrics(object):
+    def test_sampling(self):
+        metrics = APIMetrics()
+        samples = [metrics.record_invocation() for _ in range(32)]
+        assert samples.count(True) == 32 // APIMetrics.SIZE_SAMPLE_RATE
+        assert samples[0]
+
+    def test_snapshot(self):
+        metrics = APIMetrics()
+        metrics.record_invocation()
+        metrics.record_error()
+        metrics.run_time.record(0.5)
+
+        snapshot = metrics.snapshot()
+        assert snapshot["invocations"] == 1
+        assert snapshot["errors"] == 1
+        assert snapshot["run_time"]["count"] == 1
+        assert snapshot["queue_wait"]["count"] == 0
@@ -0,0 +1,51 @@
+import time
+from threading import Event
+
+from weavelib.rpc.pending import PendingCalls
+
+
+class TestPendingCalls(object):
+    def test_add_pop(self):
+        pending = PendingCalls()
+        pending.add("1", print)
+        assert len(pending) == 1
+        assert pending.pop("1") is print
+        assert pending.pop("1") is None
+        assert len(pending) == 0
+
+    def test_expiry(self):
+        pending = PendingCalls()
+        event = Event()
+        responses = []
+
+        def callback(response):
+            responses.append(response)
+            event.set()
+
+        pending.add("1", callback, time.time() + 0.2)
+        pending.add("2", callback, time.time() + 60)
+        assert event.wait(5)
+
+        assert responses == [{"id": "1", "error_name": "TimedOut",
+                              "error": "Deadline exceeded."}]
+        assert len(pending) == 1
+
+    def test_bounded(self):
+        pending = PendingCalls(max_size=2)
+        responses = []
+        for msg_id in "123":
+            pending.add(msg_id, responses.append)
+
+        assert len(pending) == 2
+        assert [x["id"] for x in responses] == ["1"]
+        assert pending.pop("1") is None
+
+    def test_fail_all(self):
+        pending = PendingCalls()
+        responses = []
+        pending.add("1", responses.append)
+        pending.add("2", responses.append)
+        pending.fail_all("ObjectClosed", "Stopped.")
+
+        assert [x["id"] for x in responses] == ["1", "2"]
+        assert len(pending) == 0
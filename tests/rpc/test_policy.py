@@ -0,0 +1,60 @@
+import pytest
+
+from weavelib.exceptions import BadArguments
+from weavelib.rpc import AdmissionPolicy, HedgePolicy, RetryPolicy
+
+
+class TestRetryPolicy(object):
+    def test_bad_policy(self):
+        with pytest.raises(BadArguments):
+            RetryPolicy(max_attempts=0)
+
+    def test_delay(self):
+        policy = RetryPolicy(backoff=0.1, multiplier=2, max_backoff=0.3)
+        assert [policy.delay(x) for x in (1, 2, 3)] == \
+            pytest.approx([0.1, 0.2, 0.3])
+
+
+class TestHedgePolicy(object):
+    def test_bad_policy(self):
+        with pytest.raises(BadArguments):
+            HedgePolicy(percentile=0)
+
+        with pytest.raises(BadArguments):
+            HedgePolicy(max_hedges=0)
+
+    def test_delay(self):
+        policy = HedgePolicy(percentile=90, min_delay=0.05, min_samples=10)
+        for latency in range(9):
+            policy.record(latency)
+        assert policy.delay() is None
+
+        policy.record(9)
+        assert policy.delay() == 9
+
+        policy = HedgePolicy(percentile=50, min_delay=0.05, min_samples=2)
+        policy.record(0.01)
+        policy.record(0.02)
+        assert policy.delay() == 0.05
+
+    def test_window(self):
+        policy = HedgePolicy(percentile=100, window=3, min_samples=3)
+        for latency in (10, 1, 1, 1):
+            policy.record(latency)
+        assert policy.delay() == 1
+
+
+class TestAdmissionPolicy(object):
+    def test_bad_policy(self):
+        with pytest.raises(BadArguments):
+            AdmissionPolicy(max_wait=0)
+
+    def test_check(self):
+        policy = AdmissionPolicy(max_queue_length=10, max_wait=1)
+        assert policy.check(9, 0.5) is None
+        assert policy.check(10, 0.5) is not None
+        assert policy.check(0, 2) is not None
+        assert policy.check(0, 0.5, time_left=0.4) is not None
+        assert policy.check(0, 0.5, time_left=0.6) is None
+
+        assert AdmissionPolicy().check(1000, 1000) is None
@@ -1,16 +1,26 @@
+import asyncio
+import os
 import time
 import random
+import threading
 from threading import Event
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, wait
 
 import pytest
 
-from weavelib.exceptions import BadArguments
+from weavelib.exceptions import BadArguments, BadOperation, TimedOut
+from weavelib.exceptions import Overloaded
 from weavelib.messaging import WeaveConnection
-from weavelib.rpc import OneOf
+from weavelib.rpc import OneOf, CachePolicy, HedgePolicy, RetryPolicy
+from weavelib.rpc import AdmissionPolicy, ReplicaPool
+from weavelib.rpc import get_request_context, propagate_context
 from weavelib.rpc import RPCClient, RPCServer, ServerAPI, get_rpc_caller
 from weavelib.rpc import ArgParameter, KeywordParameter, RemoteAPIError
-from weavelib.rpc import find_rpc, extract_rpc_payload
+from weavelib.rpc import find_rpc, extract_rpc_payload, RPCResolver
+from weavelib.rpc import get_resolver, RequestContext
+from weavelib.rpc.demux import demuxes
+from weavelib.rpc.pending import scheduler
+from weavelib.rpc.rpc import resolvers
 from weavelib.services import BaseService, MessagingEnabled
 
 from test_utils import MessagingService, DummyEnvService
@@ -19,8 +29,34 @@ from test_utils import MessagingService, DummyEnvService
 MESSAGING_PLUGIN_URL = "https://github.com/HomeWeave/WeaveServer.git"
 
 
+def cpu_bound(num):
+    return sum(x * x for x in range(num))
+
+
+def time_left():
+    return get_request_context().remaining()
+
+
+class ReplicatedService(MessagingEnabled, BaseService):
+    def __init__(self, conn, token, rpc_info=None):
+        super(ReplicatedService, self).__init__(auth_token=token, conn=conn)
+        apis = [
+            ServerAPI("pid", "desc", [], self.pid),
+        ]
+        self.rpc_server = RPCServer("replicated", "desc", apis, self,
+                                    replica_of=rpc_info)
+
+    def pid(self):
+        time.sleep(0.2)
+        return os.getpid()
+
+
+def replica_server(conn, token, rpc_info):
+    return ReplicatedService(conn, token, rpc_info).rpc_server
+
+
 class DummyService(MessagingEnabled, BaseService):
-    def __init__(self, conn, token):
+    def __init__(self, conn, token, name="name", **kwargs):
         super(DummyService, self).__init__(auth_token=token, conn=conn)
         apis = [
             ServerAPI("api1", "desc1", [
@@ -29,6 +65,10 @@ class DummyService(MessagingEnabled, BaseService):
                 KeywordParameter("k3", "d3", bool)
             ], self.api1),
             ServerAPI("api2", "desc2", [], self.api2),
+            ServerAPI("join", "desc", [
+                KeywordParameter("second", "d", str),
+                KeywordParameter("first", "d", str)
+            ], self.join),
             ServerAPI("api3", "desc3", [], self.api3),
             ServerAPI("callback", "c", [
                 ArgParameter("param", "d", self.get_param)
@@ -36,11 +76,43 @@ class DummyService(MessagingEnabled, BaseService):
             ServerAPI("change_param", "c", [
                 ArgParameter("param", "d", str)
             ], self.change_param),
-            ServerAPI("exception", "desc2", [], self.exception)
+            ServerAPI("reverse", "c", [
+                ArgParameter("data", "d", bytes)
+            ], self.reverse),
+            ServerAPI("exception", "desc2", [], self.exception),
+            ServerAPI("async_api", "desc", [
+                ArgParameter("delay", "d", int)
+            ], self.async_api),
+            ServerAPI("async_caller", "desc", [], self.async_caller),
+            ServerAPI("context", "desc", [], self.context),
+            ServerAPI("async_context", "desc", [], self.async_context),
+            ServerAPI("limited", "desc", [
+                ArgParameter("delay", "d", int)
+            ], self.limited, max_concurrency=1),
+            ServerAPI("cpu_bound", "desc", [
+                ArgParameter("num", "d", int)
+            ], cpu_bound, max_concurrency=2, use_processes=True),
+            ServerAPI("time_left", "desc", [], time_left, max_concurrency=1,
+                      use_processes=True),
+            ServerAPI("cached", "desc", [
+                ArgParameter("num", "d", int)
+            ], self.cached, cache_policy=CachePolicy(60)),
+            ServerAPI("numbers", "desc", [
+                ArgParameter("count", "d", int)
+            ], self.numbers),
+            ServerAPI("async_numbers", "desc", [
+                ArgParameter("count", "d", int)
+            ], self.async_numbers),
+            ServerAPI("idempotent", "desc", [
+                ArgParameter("delay", "d", int)
+            ], self.idempotent, idempotent=True),
         ]
-        self.rpc_server = RPCServer("name", "desc", apis, self)
+        self.rpc_server = RPCServer(name, "desc", apis, self, **kwargs)
         self.paused = False
         self.available_params = ["1", "2"]
+        self.cached_calls = 0
+        self.idempotent_calls = 0
+        self.produced = 0
 
     def api1(self, p1, p2, k3):
         if type(p1) != str or type(p2) != int or type(k3) != bool:
@@ -54,6 +126,9 @@ class DummyService(MessagingEnabled, BaseService):
     def api2(self):
         return "API2"
 
+    def join(self, first, second):
+        return first + second
+
     def api3(self):
         def execute_api_internal():
             return get_rpc_caller()
@@ -65,6 +140,9 @@ class DummyService(MessagingEnabled, BaseService):
     def get_param(self):
         return OneOf(*self.available_params)
 
+    def reverse(self, data):
+        return data[::-1]
+
     def change_param(self, value):
         self.available_params = value.split(",")
         self.rpc_server.update_rpc()
@@ -72,6 +150,55 @@ class DummyService(MessagingEnabled, BaseService):
     def exception(self):
         raise RuntimeError("dummy")
 
+    async def async_api(self, delay):
+        await asyncio.sleep(delay)
+        if delay < 0:
+            raise RuntimeError("dummy")
+        return delay
+
+    def limited(self, delay):
+        time.sleep(delay)
+        return delay
+
+    def cached(self, num):
+        self.cached_calls += 1
+        return num * self.cached_calls
+
+    def idempotent(self, delay):
+        self.idempotent_calls += 1
+        time.sleep(delay)
+        return self.idempotent_calls
+
+    def numbers(self, count):
+        for num in range(abs(count)):
+            self.produced = num + 1
+            if count < 0 and num == 50:
+                raise RuntimeError("dummy")
+            yield num
+
+    async def async_numbers(self, count):
+        for num in range(count):
+            await asyncio.sleep(0)
+            yield get_rpc_caller()["app_name"] + str(num)
+
+    async def async_caller(self):
+        return get_rpc_caller()
+
+    def context(self):
+        def get_context():
+            context = get_request_context()
+            return [context.request_id, context.received_at,
+                    get_rpc_caller()]
+
+        with ThreadPoolExecutor(1) as executor:
+            return executor.submit(propagate_context(get_context)).result()
+
+    async def async_context(self):
+        async def get_context():
+            return [get_request_context().request_id, get_rpc_caller()]
+
+        return await asyncio.create_task(get_context())
+
     def get_service_queue_name(self, path):
         return "/" + path
 
@@ -175,6 +302,503 @@ class TestRPC(object):
             exc.shutdown()
         client.stop()
 
+    def test_batch_invoke(self):
+        info = self.service.rpc_server.info_message
+        client = RPCClient(self.conn, info, self.test_token)
+        client.start()
+
+        batch = client.batch()
+        for i in range(10):
+            batch["api1"]("iter", i, k3=False)
+        batch["api2"]()
+
+        expected = ["iter{}False".format(i) for i in range(10)] + ["API2"]
+        assert batch.execute(block=True) == expected
+
+        batch = client.batch()
+        batch["api2"]()
+        batch["exception"]()
+        with pytest.raises(RemoteAPIError):
+            batch.execute(block=True)
+
+        with pytest.raises(BadArguments):
+            client.batch()["api1"]("iter")
+
+        client.stop()
+
+    def test_future_invoke(self):
+        info = self.service.rpc_server.info_message
+        client = RPCClient(self.conn, info, self.test_token)
+        client.start()
+
+        futures = [client["api1"]("iter", i, k3=True, _future=True)
+                   for i in range(50)]
+        wait(futures)
+        assert [x.result() for x in futures] == ["iter{}True".format(i)
+                                                 for i in range(50)]
+
+        with pytest.raises(RemoteAPIError):
+            client["exception"](_future=True).result()
+
+        batch = client.batch()
+        batch["api2"]()
+        assert batch.execute(future=True).result() == ["API2"]
+
+        client.stop()
+
+    def test_async_invoke(self):
+        info = self.service.rpc_server.info_message
+        client = RPCClient(self.conn, info, self.test_token)
+        client.start()
+
+        async def gather():
+            return await asyncio.gather(*(client["api2"](_async=True)
+                                          for _ in range(20)))
+
+        assert asyncio.run(gather()) == ["API2"] * 20
+
+        client.stop()
+
+    def test_coroutine_handlers(self):
+        info = self.service.rpc_server.info_message
+        client = RPCClient(self.conn, info, self.test_token)
+        client.start()
+
+        start = time.time()
+        futures = [client["async_api"](1, _future=True) for _ in range(50)]
+        assert [x.result() for x in futures] == [1] * 50
+        assert time.time() - start < 5
+
+        # Sync handlers are not blocked by coroutines.
+        future = client["async_api"](2, _future=True)
+        assert client["api2"](_block=True) == "API2"
+        assert not future.done()
+        assert future.result() == 2
+
+        with pytest.raises(RemoteAPIError):
+            client["async_api"](-1, _block=True)
+
+        assert client["async_caller"](_block=True)["app_name"] == "x"
+
+        # Responses are not sent from the event loop.
+        server = self.service.rpc_server
+        threads = []
+        send = server.sender.send
+
+        def spy(*args, **kwargs):
+            threads.append(threading.current_thread())
+            return send(*args, **kwargs)
+
+        server.sender.send = spy
+        assert client["async_api"](0, _block=True) == 0
+        assert len(list(client["async_numbers"](100))) == 100
+        assert threads and server.loop_thread not in threads
+
+        client.stop()
+
+    def test_concurrency_limit(self):
+        info = self.service.rpc_server.info_message
+        client = RPCClient(self.conn, info, self.test_token)
+        client.start()
+
+        futures = [client["limited"](1, _future=True) for _ in range(3)]
+
+        # Other APIs get to run, while "limited" ones wait for each other.
+        assert client["api2"](_block=True) == "API2"
+        time.sleep(0.5)
+        stats = self.service.rpc_server.api_stats()["limited"]
+        assert stats["running"] == 1
+        assert stats["queue_depth"] == 2
+
+        assert [x.result() for x in futures] == [1, 1, 1]
+        stats = self.service.rpc_server.api_stats()["limited"]
+        assert stats["queue_depth"] == 0
+        assert stats["max_wait"] >= 1
+
+        client.stop()
+
+    def test_admission_control(self):
+        info = self.service.rpc_server.info_message
+        client = RPCClient(self.conn, info, self.test_token)
+        client.start()
+
+        self.service.rpc_server.admission_policy = \
+            AdmissionPolicy(max_queue_length=1)
+        futures = [client["limited"](1, _future=True) for _ in range(2)]
+        time.sleep(0.2)
+
+        start = time.time()
+        with pytest.raises(Overloaded):
+            client["limited"](1, _block=True)
+        assert time.time() - start < 0.5
+
+        assert [x.result() for x in futures] == [1, 1]
+        stats = self.service.rpc_server.api_stats()["limited"]
+        assert stats["rejected"] == 1
+        assert stats["avg_run_time"] >= 1
+
+        # Invocations that can't start before their deadline are rejected.
+        self.service.rpc_server.admission_policy = AdmissionPolicy()
+        futures = [client["limited"](1, _future=True) for _ in range(3)]
+        time.sleep(0.2)
+        with pytest.raises(Overloaded):
+            client["limited"](1, _block=True, _timeout=1)
+        wait(futures)
+
+        client.stop()
+
+    def test_process_pool_api(self):
+        info = self.service.rpc_server.info_message
+        client = RPCClient(self.conn, info, self.test_token)
+        client.start()
+
+        futures = [client["cpu_bound"](1000, _future=True) for _ in range(4)]
+        assert [x.result() for x in futures] == [cpu_bound(1000)] * 4
+
+        client.stop()
+
+    def test_cached_api(self):
+        info = self.service.rpc_server.info_message
+        client = RPCClient(self.conn, info, self.test_token)
+        client.start()
+        other_client = RPCClient(self.conn, info, self.test_token)
+        other_client.start()
+
+        # Memoized by the client.
+        assert client["cached"](2, _block=True) == 2
+        assert client["cached"](2, _block=True) == 2
+        assert client["cached"](2, _future=True).result() == 2
+
+        # Served from the server's cache.
+        assert other_client["cached"](2, _block=True) == 2
+        assert self.service.cached_calls == 1
+
+        assert client["cached"](3, _block=True) == 6
+
+        self.service.rpc_server.invalidate_cache("cached")
+        time.sleep(1)
+        assert client["cached"](2, _block=True) == 6
+        assert other_client["cached"](2, _block=True) == 6
+
+        for name in ("api2", "unknown"):
+            with pytest.raises(BadArguments):
+                self.service.rpc_server.invalidate_cache("cached", name)
+        assert client["cached"](2, _block=True) == 6
+
+        other_client.stop()
+        client.stop()
+
+    def test_resolver(self):
+        resolver = RPCResolver(self.conn, self.test_token, poll_interval=0.2)
+        info = resolver.resolve(MESSAGING_PLUGIN_URL, "app_manager")
+        client = resolver.client
+        assert resolver.resolve(MESSAGING_PLUGIN_URL, "app_manager") is info
+        assert resolver.client is client
+
+        event = Event()
+        changes = []
+
+        def on_change(rpc_info):
+            changes.append(rpc_info)
+            event.set()
+
+        info = resolver.watch("y", "name", on_change)
+        assert info["apis"] == self.service.rpc_server.info_message["apis"]
+        assert resolver.watch("y", "unknown", on_change) is None
+
+        rpc_client = RPCClient(self.conn, info, self.test_token)
+        rpc_client.start()
+        rpc_client["change_param"]("a,b", _block=True)
+        rpc_client.stop()
+
+        assert event.wait(5)
+        schema = changes[0]["apis"]["callback"]["args"][0]["schema"]
+        assert schema == OneOf("a", "b").json_schema()
+
+        resolver.stop()
+
+    def test_shared_objects_dropped_on_close(self):
+        conn = WeaveConnection.local()
+        conn.connect()
+        resolver = get_resolver(conn, self.test_token)
+        resolver.resolve(MESSAGING_PLUGIN_URL, "app_manager")
+        assert (conn, self.test_token) in resolvers
+        assert conn in demuxes
+
+        conn.close()
+        assert (conn, self.test_token) not in resolvers
+        assert conn not in demuxes
+
+    def test_incremental_update_rpc(self):
+        server = self.service.rpc_server
+        appmgr_api = server.appmgr_client["update_rpc"]
+        calls = []
+
+        def spy(*args, **kwargs):
+            calls.append(args)
+            return appmgr_api(*args, **kwargs)
+
+        server.appmgr_client.apis["update_rpc"] = spy
+        try:
+            infos = server.api_infos
+            assert server.update_rpc()
+            assert not calls
+            assert server.api_infos is infos
+
+            self.service.available_params = ["x", "y"]
+            server.update_rpc()
+            assert len(calls) == 1
+            assert server.api_infos["api1"] is infos["api1"]
+            assert server.api_infos["callback"]["fingerprint"] != \
+                infos["callback"]["fingerprint"]
+
+            # Failed updates are sent again.
+            def fail(*args, _block=False, _callback=None):
+                if _block:
+                    raise BadOperation("Registry unavailable.")
+                _callback({"id": None, "error_name": "BadOperation"})
+
+            infos = server.api_infos
+            self.service.available_params = ["z"]
+            server.appmgr_client.apis["update_rpc"] = fail
+            with pytest.raises(BadOperation):
+                server.update_rpc()
+            responses = []
+            server.update_rpc(callback=responses.append)
+            assert responses[0]["error_name"] == "BadOperation"
+            assert server.api_infos is infos
+
+            server.appmgr_client.apis["update_rpc"] = spy
+            server.update_rpc()
+            assert len(calls) == 2
+            assert server.api_infos is not infos
+        finally:
+            server.appmgr_client.apis["update_rpc"] = appmgr_api
+
+    def test_lazy_client_apis(self):
+        info = self.service.rpc_server.info_message
+        client = RPCClient(self.conn, info, self.test_token)
+        assert not client.apis
+
+        api = client["api2"]
+        assert client["api2"] is api
+        assert list(client.apis) == ["api2"]
+        with pytest.raises(KeyError):
+            client["unknown"]
+
+    def test_client_params_shared(self):
+        info = self.service.rpc_server.info_message
+        client1 = RPCClient(self.conn, info, self.test_token)
+        client2 = RPCClient(self.conn, info, self.test_token)
+
+        assert client1["api1"].args[0] is client2["api1"].args[0]
+
+    def test_replicas(self):
+        primary = ReplicatedService(self.conn, self.test_token)
+        primary.rpc_server.start()
+        pool = ReplicaPool(replica_server, 2)
+        pool.start(primary.rpc_server)
+
+        info = primary.rpc_server.info_message
+        client = RPCClient(self.conn, info, self.test_token)
+        client.start()
+
+        futures = [client["pid"](_future=True) for _ in range(12)]
+        pids = {x.result(10) for x in futures}
+        assert len(pids) > 1
+        assert os.getpid() in pids
+
+        with pytest.raises(BadOperation):
+            replica_server(self.conn, self.test_token, info).update_rpc()
+
+        client.stop()
+        pool.stop()
+        primary.rpc_server.stop()
+
+    def test_bytes_arguments(self):
+        info = self.service.rpc_server.info_message
+        client = RPCClient(self.conn, info, self.test_token)
+        client.start()
+
+        data = bytes(range(256)) * 4
+        assert client["reverse"](data, _block=True) == data[::-1]
+        with pytest.raises(BadArguments):
+            client["reverse"]("str", _block=True)
+
+        client.stop()
+
+    def test_shared_response_demux(self):
+        info = self.service.rpc_server.info_message
+        clients = [RPCClient(self.conn, info, self.test_token)
+                   for _ in range(2)]
+        for client in clients:
+            client.start()
+        assert clients[0].demux is clients[1].demux
+        assert clients[0].client_cookie == clients[1].client_cookie
+
+        threads = threading.active_count()
+        more_clients = [RPCClient(self.conn, info, self.test_token)
+                        for _ in range(5)]
+        for client in more_clients:
+            client.start()
+        assert threading.active_count() == threads
+        for client in more_clients:
+            assert client["api2"](_block=True) == "API2"
+
+        # Blocking calls work from within callbacks.
+        event = Event()
+        result = []
+
+        def callback(res):
+            result.append(clients[1]["api2"](_block=True))
+            event.set()
+
+        clients[0]["api2"](_callback=callback)
+        assert event.wait(5)
+        assert result == ["API2"]
+
+        for client in clients + more_clients:
+            client.stop()
+
+    def test_compact_encoding(self):
+        service = DummyService(self.conn, self.test_token, name="compact",
+                               compact=True)
+        service.service_start()
+        info = service.rpc_server.info_message
+        assert sorted(x["index"] for x in info["apis"].values()) == \
+            list(range(len(info["apis"])))
+
+        client = RPCClient(self.conn, info, self.test_token)
+        client.start()
+        requests = []
+        send = client.sender.send
+
+        def spy(obj, headers=None):
+            requests.append(obj)
+            return send(obj, headers=headers)
+
+        client.sender.send = spy
+
+        res = client["api1"]("hello", 5, k3=False, _block=True)
+        assert res == "hello5False"
+        assert requests[0]["call"] == [info["apis"]["api1"]["index"],
+                                       requests[0]["call"][1],
+                                       ["hello", 5, False]]
+        assert isinstance(requests[0]["call"][1], int)
+
+        with pytest.raises(BadArguments):
+            client["api1"]("hello", "5", k3=False, _block=True)
+        assert list(client["numbers"](100)) == list(range(100))
+        assert client["idempotent"](0, _block=True) == 1
+        with pytest.raises(BadArguments):
+            client["join"](first="a", second="b", third="c", _block=True)
+        client.stop()
+
+        # Kwargs don't depend on the order they are listed in the info.
+        join_info = dict(info["apis"]["join"])
+        join_info["kwargs"] = dict(reversed(list(join_info["kwargs"].items())))
+        client = RPCClient(self.conn, dict(info, apis={"join": join_info}),
+                           self.test_token)
+        client.start()
+        assert client["join"](first="a", second="b", _block=True) == "ab"
+        client.stop()
+
+        service.service_stop()
+
+    def test_local_calls(self):
+        service = DummyService(self.conn, self.test_token, name="local",
+                               allow_local=True)
+        service.service_start()
+        info = service.rpc_server.info_message
+
+        client = RPCClient(self.conn, info, self.test_token)
+        client.start()
+        sent = []
+        client.sender.send = lambda obj, headers=None: sent.append(obj)
+
+        assert client["api1"]("hello", 5, k3=False, _block=True) == \
+            "hello5False"
+        assert client["api3"](_block=True) is None
+        assert list(client["numbers"](100)) == list(range(100))
+        with pytest.raises(BadArguments):
+            client["api1"]("hello", "5", k3=False, _block=True)
+        assert not sent
+        assert client.pending_count == 0
+        client.stop()
+
+        # Other apps go through the message server.
+        client = RPCClient(self.conn, info, "other-token")
+        client.start()
+        client.sender.send = lambda obj, headers=None: sent.append(obj)
+        client["api2"]()
+        assert len(sent) == 1
+        client.stop()
+
+        service.service_stop()
+
+    def test_coalescing(self):
+        info = self.service.rpc_server.info_message
+        client = RPCClient(self.conn, info, self.test_token, coalesce=True)
+        client.start()
+
+        futures = [client["idempotent"](1, _future=True) for _ in range(5)]
+        other = client["idempotent"](0, _future=True)
+        assert len({x.result(5) for x in futures}) == 1
+        other.result(5)
+        assert self.service.idempotent_calls == 2
+
+        # Only concurrent calls are coalesced.
+        assert client["idempotent"](0, _block=True) == 3
+        assert client.pending_count == 0
+        assert not client.coalesced
+
+        def fail_send(request):
+            raise IOError("Connection closed.")
+
+        client.send = fail_send
+        with pytest.raises(IOError):
+            client["idempotent"](0, _future=True)
+        assert client.pending_count == 0
+        assert not client.coalesced
+
+        client.stop()
+
+    def test_stats(self):
+        info = self.service.rpc_server.info_message
+        client = RPCClient(self.conn, info, self.test_token)
+        client.start()
+
+        for i in range(3):
+            client["api1"]("hello", i, k3=False, _block=True)
+        client["cpu_bound"](10, _block=True)
+        with pytest.raises(RemoteAPIError):
+            client["exception"](_block=True)
+
+        stats = client["_rpc_stats"](_block=True)
+
+        api1_stats = stats["api1"]
+        assert api1_stats["invocations"] == 3
+        assert api1_stats["errors"] == 0
+        assert api1_stats["queue_wait"]["count"] == 3
+        assert api1_stats["run_time"]["count"] == 3
+        assert api1_stats["send_time"]["count"] == 3
+        assert api1_stats["request_size"]["count"] == 1
+        assert api1_stats["response_size"]["count"] == 1
+        assert api1_stats["completed"] == 3
+
+        assert stats["cpu_bound"]["run_time"]["count"] == 1
+        assert stats["exception"]["errors"] == 1
+
+        stats = self.service.rpc_server.stats()
+        assert stats["_rpc_stats"]["invocations"] == 1
+
+        with pytest.raises(BadArguments):
+            RPCServer("name", "desc", [
+                ServerAPI("_rpc_stats", "desc", [], self.service.api2)
+            ], self.service)
+
+        client.stop()
+
     def test_callback_rpc_invoke(self):
         info = self.service.rpc_server.info_message
         client = RPCClient(self.conn, info, self.test_token)
@@ -210,6 +834,156 @@ class TestRPC(object):
 
         client.stop()
 
+    def test_deadlines(self):
+        info = self.service.rpc_server.info_message
+        client = RPCClient(self.conn, info, self.test_token)
+        client.start()
+
+        # Occupy the only slot, so that the next call waits past its deadline.
+        future = client["limited"](1, _future=True)
+        start = time.time()
+        with pytest.raises(TimedOut):
+            client["limited"](0, _block=True, _timeout=0.5)
+        assert time.time() - start < 1
+        assert future.result() == 1
+        assert client.pending_count == 0
+
+        time.sleep(0.5)
+        stats = self.service.rpc_server.api_stats()["limited"]
+        assert stats["completed"] == 2
+
+        with pytest.raises(TimedOut):
+            client["async_api"](2, _future=True, _timeout=0.5).result()
+
+        batch = client.batch()
+        batch["async_api"](2)
+        with pytest.raises(TimedOut):
+            batch.execute(block=True, timeout=0.5)
+
+        assert client["api2"](_block=True, _timeout=5) == "API2"
+        assert 0 < client["time_left"](_block=True, _timeout=5) <= 5
+        assert client.pending_count == 0
+
+        client.stop()
+
+    def test_retry_and_hedge(self):
+        info = self.service.rpc_server.info_message
+        client = RPCClient(self.conn, info, self.test_token,
+                           hedge_policy=HedgePolicy(min_samples=5),
+                           retry_policy=RetryPolicy(backoff=0.1))
+        client.start()
+
+        assert client["idempotent"].idempotent
+        assert not client["limited"].idempotent
+
+        for i in range(5):
+            assert client["idempotent"](0, _block=True) == i + 1
+        assert client["idempotent"].hedge_policy is None
+        assert client.hedge_policy.delay() is not None
+
+        threads = []
+        send = client.send
+
+        def spy(request):
+            threads.append(threading.current_thread())
+            return send(request)
+
+        client.send = spy
+
+        # The first attempt times out, and is retried. Hedges and retries are
+        # answered by the same invocation on the server.
+        assert client["idempotent"](1, _block=True, _timeout=0.7) == 6
+        assert self.service.idempotent_calls == 6
+        assert len(threads) > 1
+        assert scheduler.thread not in threads
+
+        # Calls to other APIs are not retried.
+        with pytest.raises(TimedOut):
+            client["limited"](1, _block=True, _timeout=0.5)
+
+        # Retries are bound by the deadline of the request being handled.
+        context = RequestContext(None, "id", time.time(), time.time() + 0.3)
+        start = time.time()
+        with pytest.raises(TimedOut):
+            context.run(client["idempotent"], 1, _block=True, _timeout=5)
+        assert time.time() - start < 0.9
+
+        client.stop()
+
+    def test_streaming(self):
+        info = self.service.rpc_server.info_message
+        client = RPCClient(self.conn, info, self.test_token)
+        client.start()
+
+        stream = client["numbers"](1000)
+        assert next(stream) == 0
+
+        # The server does not run too far ahead of the client.
+        time.sleep(0.5)
+        assert self.service.produced <= 9 * 32
+        assert list(stream) == list(range(1, 1000))
+        assert client.pending_count == 0
+
+        assert list(client["numbers"](0)) == []
+        assert list(client["async_numbers"](100)) == \
+            ["x" + str(x) for x in range(100)]
+
+        with pytest.raises(RemoteAPIError):
+            list(client["numbers"](-100))
+
+        with pytest.raises(BadArguments):
+            client["numbers"](1, _block=True, _future=True)
+
+        with pytest.raises(BadArguments):
+            client.batch()["numbers"](10)
+
+        with client["numbers"](1000) as stream:
+            next(stream)
+        time.sleep(0.5)
+        assert not self.service.rpc_server.streams
+        assert client.pending_count == 0
+
+        # Abandoned streams fail rather than end early.
+        self.service.rpc_server.STREAM_ACK_TIMEOUT = 0.3
+        for api in ("numbers", "async_numbers"):
+            stream = client[api](1000)
+            next(stream)
+            time.sleep(0.6)
+            with pytest.raises(TimedOut):
+                list(stream)
+        assert not self.service.rpc_server.streams
+
+        client.stop()
+
+    def test_request_context(self):
+        info = self.service.rpc_server.info_message
+        client = RPCClient(self.conn, info, self.test_token)
+        client.start()
+
+        caller = {"app_name": "x", "app_url": "y", "app_type": "plugin"}
+        responses = []
+        event = Event()
+
+        def callback(response):
+            responses.append(response)
+            event.set()
+
+        client["context"](_callback=callback)
+        assert event.wait(5)
+        request_id, received_at, res_caller = responses[0]["result"]
+        assert request_id == responses[0]["id"]
+        assert 0 <= time.time() - received_at < 5
+        assert res_caller == caller
+
+        request_id, res_caller = client["async_context"](_block=True)
+        assert request_id.startswith("invocation-")
+        assert res_caller == caller
+
+        assert get_request_context() is None
+        assert get_rpc_caller() is None
+
+        client.stop()
+
     def test_api_with_exception(self):
         info = self.service.rpc_server.info_message
         client = RPCClient(self.conn, info, self.test_token)
@@ -0,0 +1,93 @@
+import asyncio
+
+import pytest
+
+from weavelib.exceptions import ProtocolError
+from weavelib.rpc import extract_rpc_payload
+from weavelib.rpc.stream import ResponseStream, ServerStream
+from weavelib.rpc.stream import chunked, chunked_async
+
+
+def stream_responses(chunks):
+    responses = [{"id": "1", "stream_seq": seq, "items": items}
+                 for seq, items in enumerate(chunks)]
+    responses.append({"id": "1", "stream_seq": len(chunks), "end": True})
+    return responses
+
+
+class TestChunked(object):
+    def test_chunked(self):
+        assert list(chunked(range(5), 2)) == [[0, 1], [2, 3], [4]]
+        assert list(chunked([], 2)) == []
+
+    def test_chunked_async(self):
+        async def numbers():
+            for num in range(5):
+                yield num
+
+        async def collect():
+            return [x async for x in chunked_async(numbers(), 2)]
+
+        assert asyncio.run(collect()) == [[0, 1], [2, 3], [4]]
+
+
+class TestServerStream(object):
+    def test_credits(self):
+        responses = []
+        stream = ServerStream("1", "cmd", responses.append, 2)
+        assert stream.acquire(0)
+        stream.send([1])
+        assert stream.acquire(0)
+        stream.send([2])
+        assert not stream.acquire(0.1)
+
+        stream.add_credits(1)
+        assert stream.acquire(0)
+        stream.send([3])
+
+        assert [x["stream_seq"] for x in responses] == [0, 1, 2]
+        assert [x["items"] for x in responses] == [[1], [2], [3]]
+
+    def test_cancel(self):
+        stream = ServerStream("1", "cmd", None, 2)
+        stream.add_credits(1, cancel=True)
+        assert not stream.acquire(0)
+
+
+class TestResponseStream(object):
+    def test_iterate(self):
+        acks = []
+        stream = ResponseStream("1", 4, lambda *x: acks.append(x),
+                                extract_rpc_payload)
+        for response in stream_responses([[0, 1], [2], [3, 4], [5]]):
+            stream.on_response(response)
+
+        assert list(stream) == list(range(6))
+        assert acks == [(2, False), (2, False)]
+
+    def test_error(self):
+        stream = ResponseStream("1", 4, None, extract_rpc_payload)
+        stream.on_response({"id": "1", "stream_seq": 0, "items": [1]})
+        stream.on_response({"id": "1", "error": "dummy"})
+
+        assert next(stream) == 1
+        with pytest.raises(RuntimeError):
+            next(stream)
+        with pytest.raises(StopIteration):
+            next(stream)
+
+    def test_bad_sequence(self):
+        stream = ResponseStream("1", 4, None, extract_rpc_payload)
+        stream.on_response({"id": "1", "stream_seq": 1, "items": [1]})
+
+        with pytest.raises(ProtocolError):
+            next(stream)
+
+    def test_close(self):
+        acks = []
+        stream = ResponseStream("1", 4, lambda *x: acks.append(x),
+                                extract_rpc_payload)
+        stream.close()
+        stream.close()
+        assert acks == [(0, True)]
+        assert list(stream) == []
@@ -1,5 +1,5 @@
 from weavelib.exceptions import ObjectNotFound
-from weavelib.rpc import RPCClient
+from weavelib.rpc import RPCClient, get_resolver
 
 
 class AppDBConnection(object):
@@ -9,9 +9,9 @@ class AppDBConnection(object):
         self.db_rpc = None
 
     def start(self):
-        rpc = self.service.rpc_client["rpc_info"]
-        rpc_info = rpc("weaveserver.services.simpledb", "object_store",
-                       _block=True)
+        resolver = get_resolver(self.conn, self.service.token)
+        rpc_info = resolver.resolve("weaveserver.services.simpledb",
+                                    "object_store")
         self.db_rpc = RPCClient(self.conn, rpc_info, self.service.token)
         self.db_rpc.start()
 
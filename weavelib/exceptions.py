@@ -52,3 +52,11 @@ class PluginLoadError(WeaveException):
 
 class TimedOut(WeaveException):
     pass
+
+
+class OutboxFull(WeaveException):
+    pass
+
+
+class Overloaded(WeaveException):
+    pass
@@ -2,6 +2,7 @@ from .messaging import Message, Sender, Receiver
 from .messaging import read_message, serialize_message, ensure_ok_message
 from .messaging import discover_message_server, exception_to_message
 from .messaging import WeaveConnection
+from .outbox import Outbox
 
 __all__ = [
     'WeaveConnection',
@@ -13,4 +14,5 @@ __all__ = [
     'discover_message_server',
     'exception_to_message',
     'ensure_ok_message',
+    'Outbox',
 ]
@@ -1,6 +1,7 @@
 import json
 import logging
 import socket
+from io import BytesIO
 from threading import Lock, Event, Thread
 from uuid import uuid4
 try:
@@ -14,6 +15,10 @@ from weavelib.exceptions import ProtocolError, WeaveException, ObjectClosed
 
 logger = logging.getLogger(__name__)
 
+# Bytes in a message are sent as raw attachments after the message, and
+# referenced in its JSON as {ATTACHMENT_KEY: <index>}.
+ATTACHMENT_KEY = "$attachment"
+
 
 def exception_to_message(ex):
     msg = Message("result")
@@ -23,7 +28,58 @@ def exception_to_message(ex):
     return msg
 
 
-def parse_message(lines):
+def dump_json(obj, attachments):
+    """ Serializes obj to JSON, moving bytes into the attachments list. """
+    def to_attachment(item):
+        if not isinstance(item, (bytes, bytearray)):
+            raise TypeError("Not JSON serializable: " + type(item).__name__)
+        attachments.append(bytes(item))
+        return {ATTACHMENT_KEY: len(attachments) - 1}
+
+    return json.dumps(obj, default=to_attachment)
+
+
+def load_json(data, attachments):
+    """ Reverses dump_json(..). """
+    if not attachments:
+        return json.loads(data)
+
+    def from_attachment(obj):
+        if len(obj) != 1 or ATTACHMENT_KEY not in obj:
+            return obj
+        index = obj[ATTACHMENT_KEY]
+        if not isinstance(index, int) or not 0 <= index < len(attachments):
+            raise ProtocolError("Bad attachment reference.")
+        return attachments[index]
+
+    return json.loads(data, object_hook=from_attachment)
+
+
+def read_attachments(sizes, read):
+    try:
+        sizes = [int(x) for x in sizes.split(",")]
+    except ValueError:
+        raise ProtocolError("Bad attachment sizes.")
+
+    if read is None:
+        raise ProtocolError("Unexpected attachments.")
+
+    attachments = []
+    for size in sizes:
+        if size < 0:
+            raise ProtocolError("Bad attachment sizes.")
+        data = read(size)
+        if len(data) != size:
+            raise ProtocolError("Truncated attachment.")
+        attachments.append(data)
+    return attachments
+
+
+def parse_message(lines, read=None):
+    """
+    Parses the header lines of a message. If the message has attachments,
+    they are read using read(num_bytes).
+    """
     required_fields = {"OP"}
     fields = {}
     for line in lines:
@@ -35,9 +91,13 @@ def parse_message(lines):
     if required_fields - set(fields.keys()):
         raise ProtocolError("Required fields missing.")
 
+    attachments = []
+    if "ATT" in fields:
+        attachments = read_attachments(fields.pop("ATT"), read)
+
     if "MSG" in fields:
         try:
-            obj = json.loads(fields["MSG"])
+            obj = load_json(fields["MSG"], attachments)
         except json.decoder.JSONDecodeError:
             raise ProtocolError("Bad JSON.")
         task = obj
@@ -49,7 +109,11 @@ def parse_message(lines):
     return msg
 
 
-def serialize_message(msg):
+def serialize_message(msg, attachments=None):
+    """
+    Returns the header lines of a message. Bytes in the message are
+    collected into the attachments list, to be sent right after the lines.
+    """
     msg_lines = [
         "OP " + msg.op,
     ]
@@ -58,11 +122,22 @@ def serialize_message(msg):
         msg_lines.append(key + " " + str(value))
 
     if msg.task is not None:
-        msg_lines.append("MSG " + json.dumps(msg.task))
+        if attachments is None:
+            attachments = []
+        msg_lines.append("MSG " + dump_json(msg.task, attachments))
+        if attachments:
+            msg_lines.append("ATT " + ",".join(str(len(x))
+                                               for x in attachments))
     msg_lines.append("")  # Last newline before blank line.
     return "\n".join(msg_lines)
 
 
+def encode_message(msg):
+    attachments = []
+    lines = serialize_message(msg, attachments)
+    return b"".join([(lines + "\n").encode()] + attachments)
+
+
 def read_message(conn):
     # Reading group of lines
     lines = []
@@ -79,14 +154,32 @@ def read_message(conn):
         if not stripped_line:
             break
         lines.append(stripped_line.decode("UTF-8"))
-    return parse_message(lines)
+    return parse_message(lines, conn.read)
 
 
 def write_message(conn, msg):
-    conn.write((serialize_message(msg) + "\n").encode())
+    conn.write(encode_message(msg))
     conn.flush()
 
 
+def iter_chunks(data, chunk_size):
+    """
+    Splits a bytes-like object, a file-like object or an iterable of
+    bytes-like objects.
+    """
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        view = memoryview(data).cast("B")
+        for start in range(0, len(view), chunk_size):
+            yield bytes(view[start:start + chunk_size])
+    elif hasattr(data, "read"):
+        for chunk in iter(lambda: data.read(chunk_size), b""):
+            yield chunk
+    else:
+        for item in data:
+            for chunk in iter_chunks(item, chunk_size):
+                yield chunk
+
+
 def raise_message_exception(err, extra):
     known_exceptions = weavelib.exceptions
     objects = [getattr(known_exceptions, x) for x in dir(known_exceptions)]
@@ -134,12 +227,24 @@ class MessageWaiter(object):
             raise IOError("Connection closed.")
         return item
 
-    @message.setter
-    def message(self, msg):
+    def put(self, msg):
         self.queue.put(msg)
 
     def close(self):
-        self.message = self.CONNECTION_CLOSED
+        self.put(self.CONNECTION_CLOSED)
+
+
+class CallbackReader(object):
+    """ Hands the messages of a session to a callback as they arrive. """
+
+    def __init__(self, callback):
+        self.callback = callback
+
+    def put(self, msg):
+        self.callback(msg)
+
+    def close(self):
+        self.callback(MessageWaiter.CONNECTION_CLOSED)
 
 
 class WeaveConnection(object):
@@ -156,6 +261,7 @@ class WeaveConnection(object):
         self.wfile = None
         self.readers_lock = Lock()
         self.readers = {}
+        self.close_listeners = []
         self.reader_thread = Thread(target=self.read_loop)
         self.send_lock = Lock()
         self.active = False
@@ -236,6 +342,8 @@ class WeaveConnection(object):
             raise ProtocolError("Bad Response")
 
     def send_internal(self, msg):
+        if not self.active:
+            raise IOError("Connection closed.")
         with self.send_lock:
             write_message(self.wfile, msg)
 
@@ -254,7 +362,19 @@ class WeaveConnection(object):
                                serialize_message(msg))
                 continue
 
-            waiter.message = msg
+            waiter.put(msg)
+
+    def add_reader(self, session_id, callback):
+        """
+        Messages for session_id are handed to callback(msg), and
+        MessageWaiter.CONNECTION_CLOSED once the connection is closed.
+        """
+        with self.readers_lock:
+            self.readers[session_id] = CallbackReader(callback)
+
+    def remove_reader(self, session_id):
+        with self.readers_lock:
+            self.readers.pop(session_id, None)
 
     def interrupt_session(self, session_id):
         with self.readers_lock:
@@ -263,10 +383,20 @@ class WeaveConnection(object):
                 return
             waiter.close()
 
+    def add_close_listener(self, callback):
+        """ callback() is invoked once the connection is closed. """
+        with self.readers_lock:
+            self.close_listeners.append(callback)
+
     def close(self):
         self.active = False
-        for waiter in self.readers.values():
+        with self.readers_lock:
+            waiters = list(self.readers.values())
+            listeners, self.close_listeners = self.close_listeners, []
+        for waiter in waiters:
             waiter.close()
+        for callback in listeners:
+            callback()
 
         try:
             self.sock.shutdown(socket.SHUT_RDWR)
@@ -281,14 +411,30 @@ class WeaveConnection(object):
 
 
 class Sender(object):
-    def __init__(self, conn, channel, **kwargs):
+    STREAM_CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, conn, channel, outbox=None, **kwargs):
         self.channel = channel
         self.extra_headers = {x.upper(): y for x, y in kwargs.items()}
         self.conn = conn
+        self.outbox = outbox
         self.session_id = "sender-session-" + str(uuid4())
 
     def start(self):
-        pass
+        if self.outbox is not None:
+            try:
+                self.drain()
+            except IOError:
+                logger.warning("Unable to drain outbox for: %s", self.channel)
+
+    def rebind(self, conn):
+        """
+        Sends over conn from now on, replaying the outbox to it first.
+        WeaveConnection doesn't reconnect on its own, so this is how buffered
+        messages get delivered once a new connection is up.
+        """
+        self.conn = conn
+        self.start()
 
     def send(self, obj, headers=None):
         if isinstance(obj, Message):
@@ -301,7 +447,56 @@ class Sender(object):
             msg.headers.update(headers)
 
         msg.headers["C"] = self.channel
-        return self.conn.write_message(msg, self.session_id)
+        if self.outbox is None:
+            return self.conn.write_message(msg, self.session_id)
+
+        with self.outbox.lock:
+            try:
+                self.drain()
+                return self.conn.write_message(msg, self.session_id)
+            except IOError:
+                # Server unreachable. Hold on to the message till we can
+                # drain it in order.
+                self.outbox.append(encode_message(msg))
+
+    def drain(self):
+        """ Replays messages buffered in the outbox, oldest first. """
+        def send_buffered(data):
+            try:
+                msg = read_message(BytesIO(data))
+                self.conn.write_message(msg, self.session_id)
+            except IOError:
+                raise
+            except WeaveException as e:
+                # Server rejected it; retrying would block the outbox forever.
+                logger.warning("Dropping buffered message to %s: %s",
+                               self.channel, e.err_msg())
+
+        if self.outbox is None or not len(self.outbox):
+            return 0
+        if not self.conn.active:
+            raise IOError("Connection closed.")
+        return self.outbox.drain(send_buffered)
+
+    def send_stream(self, data, chunk_size=STREAM_CHUNK_SIZE, headers=None):
+        """
+        Sends data as a sequence of chunk messages, at most chunk_size bytes
+        each, followed by an end-of-stream marker. Only one chunk is held in
+        memory at a time. Use Receiver.receive_stream(..) to consume it.
+        """
+        stream_id = "stream-" + str(uuid4())
+        seq = 0
+        for chunk in iter_chunks(data, chunk_size):
+            self.send({
+                "stream": stream_id,
+                "seq": seq,
+                "data": chunk
+            }, headers=headers)
+            seq += 1
+
+        self.send({"stream": stream_id, "seq": seq, "end": True},
+                  headers=headers)
+        return stream_id
 
     def close(self):
         pass
@@ -338,7 +533,8 @@ class Receiver(object):
                 msg = self.receive()
                 self.on_message(msg.task, msg.headers)
             except IOError:
-                if not self.active:
+                # Stopped, or the connection was closed underneath.
+                if not self.active or not self.conn.active:
                     return
                 raise
             except ObjectClosed:
@@ -346,6 +542,42 @@ class Receiver(object):
                 self.stop()
                 break
 
+    def receive_stream(self, out=None):
+        """
+        Consumes one stream sent via Sender.send_stream(..). Returns an
+        iterator over the chunks in order, or if a file-like object is passed
+        in, writes the chunks to it and returns the number of bytes written.
+        Streams must not be interleaved with other messages on the channel.
+        """
+        chunks = self.iter_stream()
+        if out is None:
+            return chunks
+
+        size = 0
+        for chunk in chunks:
+            out.write(chunk)
+            size += len(chunk)
+        return size
+
+    def iter_stream(self):
+        stream_id = None
+        seq = 0
+        while True:
+            obj = self.receive().task
+            if not isinstance(obj, dict) or "stream" not in obj:
+                raise ProtocolError("Expected a stream message.")
+            if stream_id is None:
+                stream_id = obj["stream"]
+            if obj["stream"] != stream_id or obj.get("seq") != seq:
+                raise ProtocolError("Out of sequence stream message.")
+            if obj.get("end"):
+                return
+            seq += 1
+            data = obj.get("data")
+            if not isinstance(data, bytes):
+                raise ProtocolError("Stream chunk without data.")
+            yield data
+
     def stop(self):
         self.active = False
         self.conn.interrupt_session(self.session_id)
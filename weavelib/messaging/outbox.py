@@ -0,0 +1,236 @@
+"""
+Durable, append-only outbox used by Sender to hold on to pushes while the
+messaging server is unreachable.
+
+The outbox is a directory of fixed size, memory-mapped segment files. Every
+record is a (length, crc32) header followed by the payload. A separate cursor
+file remembers how far the log has been drained, so that pending records
+survive process restarts and are replayed in order.
+"""
+
+import logging
+import mmap
+import os
+import struct
+import zlib
+from threading import RLock
+
+from weavelib.exceptions import BadArguments, OutboxFull
+
+
+logger = logging.getLogger(__name__)
+
+FSYNC_ALWAYS = "always"
+FSYNC_SEGMENT = "segment"
+FSYNC_NEVER = "never"
+
+RECORD_HEADER = struct.Struct("<II")
+CURSOR = struct.Struct("<QQ")
+SEGMENT_SUFFIX = ".seg"
+
+
+class Segment(object):
+    def __init__(self, path, number, size):
+        self.number = number
+        self.path = os.path.join(path, "{:016d}{}".format(number,
+                                                          SEGMENT_SUFFIX))
+        exists = os.path.exists(self.path)
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        if not exists or os.fstat(self.fd).st_size < size:
+            os.ftruncate(self.fd, size)
+        self.size = os.fstat(self.fd).st_size
+        self.map = mmap.mmap(self.fd, self.size)
+        self.write_offset = self.scan()
+
+    def scan(self):
+        """ Returns the offset just past the last intact record. """
+        offset = 0
+        for offset, _ in self.records(0):
+            pass
+        return offset
+
+    def records(self, offset):
+        """ Yields (next_offset, payload) for every intact record. """
+        while offset + RECORD_HEADER.size <= self.size:
+            length, crc = RECORD_HEADER.unpack_from(self.map, offset)
+            start = offset + RECORD_HEADER.size
+            if not length or start + length > self.size:
+                return
+            payload = self.map[start:start + length]
+            if zlib.crc32(payload) != crc:
+                logger.warning("Truncated record in outbox segment: %s",
+                               self.path)
+                return
+            offset = start + length
+            yield offset, payload
+
+    def free_space(self):
+        return self.size - self.write_offset - RECORD_HEADER.size
+
+    def append(self, data):
+        start = self.write_offset + RECORD_HEADER.size
+        self.map[start:start + len(data)] = data
+        # Header goes in last so that a crash never exposes a partial record.
+        RECORD_HEADER.pack_into(self.map, self.write_offset, len(data),
+                                zlib.crc32(data))
+        self.write_offset = start + len(data)
+
+    def flush(self):
+        self.map.flush()
+
+    def close(self):
+        self.map.close()
+        os.close(self.fd)
+
+    def delete(self):
+        self.close()
+        os.remove(self.path)
+
+
+class Outbox(object):
+    DEFAULT_SEGMENT_SIZE = 1 << 20
+    DEFAULT_MAX_BYTES = 64 << 20
+
+    def __init__(self, path, segment_size=DEFAULT_SEGMENT_SIZE,
+                 max_bytes=DEFAULT_MAX_BYTES, fsync=FSYNC_SEGMENT):
+        if fsync not in (FSYNC_ALWAYS, FSYNC_SEGMENT, FSYNC_NEVER):
+            raise BadArguments("Unknown fsync policy: " + str(fsync))
+        if segment_size <= RECORD_HEADER.size or max_bytes < segment_size:
+            raise BadArguments("Bad outbox size limits.")
+
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.segment_size = segment_size
+        self.max_segments = max_bytes // segment_size
+        self.fsync = fsync
+        self.lock = RLock()
+        self.cursor_fd = os.open(os.path.join(path, "cursor"),
+                                 os.O_RDWR | os.O_CREAT, 0o600)
+        self.segments = []
+        self.read_segment = 0
+        self.read_offset = 0
+        self.count = 0
+        self.load()
+
+    def load(self):
+        cursor = os.pread(self.cursor_fd, CURSOR.size, 0)
+        if len(cursor) == CURSOR.size:
+            self.read_segment, self.read_offset = CURSOR.unpack(cursor)
+
+        numbers = sorted(int(x[:-len(SEGMENT_SUFFIX)])
+                         for x in os.listdir(self.path)
+                         if x.endswith(SEGMENT_SUFFIX))
+        for number in numbers:
+            segment = Segment(self.path, number, self.segment_size)
+            if number < self.read_segment:
+                segment.delete()
+            else:
+                self.segments.append(segment)
+
+        if not self.segments:
+            self.segments.append(Segment(self.path, self.read_segment,
+                                         self.segment_size))
+        if self.segments[0].number != self.read_segment:
+            self.read_segment, self.read_offset = self.segments[0].number, 0
+
+        self.count = sum(1 for _ in self.iter_pending())
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def pending_bytes(self):
+        total = sum(x.write_offset for x in self.segments)
+        return total - self.read_offset
+
+    def append(self, data):
+        if not isinstance(data, bytes):
+            data = data.encode("UTF-8")
+        if not data:
+            # A zero length header marks the end of the log.
+            raise BadArguments("Empty outbox record.")
+        if len(data) > self.segment_size - RECORD_HEADER.size:
+            raise BadArguments("Record larger than outbox segment size.")
+
+        with self.lock:
+            segment = self.segments[-1]
+            if segment.free_space() < len(data):
+                if len(self.segments) >= self.max_segments:
+                    raise OutboxFull("Outbox at " + self.path + " is full.")
+                if self.fsync != FSYNC_NEVER:
+                    segment.flush()
+                segment = Segment(self.path, segment.number + 1,
+                                  self.segment_size)
+                self.segments.append(segment)
+
+            segment.append(data)
+            self.count += 1
+            if self.fsync == FSYNC_ALWAYS:
+                segment.flush()
+
+    def iter_pending(self):
+        """ Yields (segment_number, next_offset, payload) in append order. """
+        offset = self.read_offset
+        for segment in list(self.segments):
+            for next_offset, payload in segment.records(offset):
+                yield segment.number, next_offset, payload
+            offset = 0
+
+    def peek(self):
+        with self.lock:
+            for _, _, payload in self.iter_pending():
+                return payload
+            return None
+
+    def drain(self, func):
+        """
+        Invokes func(payload) for every pending record, oldest first. A record
+        is removed only after func returns. If func raises, draining stops and
+        the exception propagates with the record still pending.
+        """
+        drained = 0
+        with self.lock:
+            for number, next_offset, payload in self.iter_pending():
+                func(payload)
+                self.commit(number, next_offset)
+                drained += 1
+            if drained:
+                self.compact()
+        return drained
+
+    def commit(self, number, offset):
+        while self.segments[0].number < number:
+            self.segments.pop(0).delete()
+
+        self.read_segment, self.read_offset = number, offset
+        self.count -= 1
+        self.write_cursor()
+
+    def compact(self):
+        segment = self.segments[0]
+        if self.count or segment.free_space() >= segment.size // 2:
+            return
+
+        # Fully drained and mostly used up: start afresh on a new segment.
+        number = segment.number + 1
+        self.segments.append(Segment(self.path, number, self.segment_size))
+        self.segments.pop(0).delete()
+        self.read_segment, self.read_offset = number, 0
+        self.write_cursor()
+
+    def write_cursor(self):
+        os.pwrite(self.cursor_fd,
+                  CURSOR.pack(self.read_segment, self.read_offset), 0)
+        if self.fsync == FSYNC_ALWAYS:
+            os.fsync(self.cursor_fd)
+
+    def close(self):
+        with self.lock:
+            for segment in self.segments:
+                if self.fsync != FSYNC_NEVER:
+                    segment.flush()
+                segment.close()
+            if self.fsync != FSYNC_NEVER:
+                os.fsync(self.cursor_fd)
+            os.close(self.cursor_fd)
+            self.segments = []
@@ -2,7 +2,7 @@ import os
 from base64 import b64encode
 from threading import Event, Lock
 
-from weavelib.rpc import RPCClient, find_rpc, extract_rpc_payload
+from weavelib.rpc import RPCClient, find_rpc, extract_rpc_payload, Bytes
 from weavelib.exceptions import WeaveException
 
 
@@ -32,9 +32,11 @@ class HTTPResourceRegistrationHelper(object):
 
     def register_content(self, content, rel_http_url, block=True,
                          callback=None):
-        param = b64encode(content).decode('ascii')
-        return self.rpc_client["register"](rel_http_url, param, _block=block,
-                                           _callback=callback)
+        api = self.rpc_client["register"]
+        # Older versions of WeaveHTTP only accept base64 encoded content.
+        if api.args[1].schema != Bytes.JSON_SCHEMA:
+            content = b64encode(content).decode('ascii')
+        return api(rel_http_url, content, _block=block, _callback=callback)
 
     def register_file(self, local_path, relative_http_url, block=True,
                       callback=None):
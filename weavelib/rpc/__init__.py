@@ -1,8 +1,13 @@
-from .rpc import ServerAPI, ClientAPI, RPCClient, RPCServer
+from .rpc import ServerAPI, ClientAPI, RPCClient, RPCServer, RPCBatch
 from .rpc import RemoteAPIError, get_rpc_caller, find_rpc
+from .rpc import RPCResolver, get_resolver
 from .rpc import extract_rpc_payload
 from .api import ArgParameter, KeywordParameter
-from .api import OneOf, ListOf, Exactly, JsonSchema, Type
+from .api import OneOf, ListOf, Exactly, JsonSchema, Type, Bytes
+from .cache import CachePolicy
+from .policy import HedgePolicy, RetryPolicy, AdmissionPolicy
+from .context import RequestContext, get_request_context, propagate_context
+from .replica import ReplicaPool
 
 
 __all__ = [
@@ -10,15 +15,27 @@ __all__ = [
     'ClientAPI',
     'RPCClient',
     'RPCServer',
+    'RPCBatch',
     'ArgParameter',
     'KeywordParameter',
     'RemoteAPIError',
     'get_rpc_caller',
     'find_rpc',
+    'RPCResolver',
+    'get_resolver',
     'extract_rpc_payload',
     'JsonSchema',
     'OneOf',
     'ListOf',
     'Type',
     'Exactly',
+    'Bytes',
+    'CachePolicy',
+    'HedgePolicy',
+    'RetryPolicy',
+    'AdmissionPolicy',
+    'RequestContext',
+    'get_request_context',
+    'propagate_context',
+    'ReplicaPool',
 ]
@@ -1,6 +1,8 @@
+import hashlib
+import json
 from uuid import uuid4
 
-from jsonschema import validate, ValidationError
+from jsonschema import Draft4Validator
 
 from weavelib.exceptions import BadArguments
 
@@ -21,14 +23,73 @@ def from_type(pytype):
     return types[pytype]
 
 
+def is_number(obj):
+    return isinstance(obj, (int, float)) and not isinstance(obj, bool)
+
+
+# Mirrors Draft4 type semantics: booleans are not numbers.
+TYPE_CHECKERS = {
+    "boolean": lambda x: isinstance(x, bool),
+    "number": is_number,
+    "string": lambda x: isinstance(x, str),
+    "object": lambda x: isinstance(x, dict),
+    "array": lambda x: isinstance(x, list),
+}
+
+
+def json_type_of(obj):
+    """ Returns the JSON type of obj (None if it has none), like Draft4. """
+    for json_type, type_check in TYPE_CHECKERS.items():
+        if type_check(obj):
+            return json_type
+    return None
+
+
+def fingerprint(info):
+    """ Returns a content hash of API info (ignoring any fingerprint in it). """
+    info = {x: y for x, y in info.items() if x != "fingerprint"}
+    content = json.dumps(info, sort_keys=True).encode("utf-8")
+    return hashlib.sha1(content).hexdigest()
+
+
 class BaseSchema(object):
-    pass
+    def checker(self):
+        """ Returns a callable that returns True if the object is valid. """
+        return Draft4Validator(self.json_schema()).is_valid
+
+    @staticmethod
+    def from_json_schema(schema):
+        """
+        Recognizes JSON schemas produced by the built-in BaseSchema classes
+        (like the ones received via API info), so that they get validated
+        using specialized checkers. Anything else is treated as JsonSchema.
+        """
+        keys = set(schema)
+        json_type = schema.get("type")
+        if schema == Bytes.JSON_SCHEMA:
+            return Bytes()
+        if keys == {"type"} and json_type in ("boolean", "number", "string"):
+            return Type({"boolean": bool, "number": float,
+                         "string": str}[json_type])
+        if keys == {"type", "enum"} and json_type in TYPE_CHECKERS and \
+                len(schema["enum"]) == 1:
+            return Exactly(schema["enum"][0])
+        if keys == {"anyOf"} and schema["anyOf"]:
+            items = [BaseSchema.from_json_schema(x) for x in schema["anyOf"]]
+            if all(isinstance(x, Exactly) for x in items):
+                return OneOf(*(x.obj for x in items))
+        if keys == {"type", "items"} and json_type == "array" and \
+                isinstance(schema["items"], dict):
+            return ListOf(BaseSchema.from_json_schema(schema["items"]))
+        return JsonSchema(schema)
 
 
 class Exactly(BaseSchema):
     def __init__(self, obj):
         self.obj = obj
-        self.json_type = from_type(type(obj))
+        self.json_type = json_type_of(obj)
+        if self.json_type is None:
+            raise BadArguments("Unsupported type.")
 
     def json_schema(self):
         return {
@@ -36,6 +97,12 @@ class Exactly(BaseSchema):
             "enum": [self.obj]
         }
 
+    def checker(self):
+        type_check = TYPE_CHECKERS[self.json_type]
+        obj = self.obj
+        return lambda x: type_check(x) and x == obj
+
+
 class JsonSchema(BaseSchema):
     def __init__(self, obj):
         self.schema = obj
@@ -53,6 +120,28 @@ class OneOf(BaseSchema):
             "anyOf": [Exactly(x).json_schema() for x in self.objs]
         }
 
+    def checker(self):
+        # Hashable values are looked up by (json_type, value) so that
+        # True/1 don't match each other, as with the JSON schema version.
+        keys = set()
+        others = []
+        for obj in self.objs:
+            if isinstance(obj, (dict, list)):
+                others.append(Exactly(obj).checker())
+            else:
+                keys.add((Exactly(obj).json_type, obj))
+
+        def check(obj):
+            if isinstance(obj, (dict, list)):
+                return any(x(obj) for x in others)
+            try:
+                return (json_type_of(obj), obj) in keys
+            except TypeError:
+                # Unhashable, so can't be one of them.
+                return False
+
+        return check
+
 
 class ListOf(BaseSchema):
     def __init__(self, base_schema):
@@ -61,6 +150,10 @@ class ListOf(BaseSchema):
     def json_schema(self):
         return {"type": "array", "items": self.item_type.json_schema()}
 
+    def checker(self):
+        item_check = self.item_type.checker()
+        return lambda x: isinstance(x, list) and all(map(item_check, x))
+
 
 class Type(BaseSchema):
     def __init__(self, pytype):
@@ -71,37 +164,88 @@ class Type(BaseSchema):
     def json_schema(self):
         return {"type": self.json_type}
 
+    def checker(self):
+        return TYPE_CHECKERS[self.json_type]
+
+
+class Bytes(BaseSchema):
+    """
+    Raw binary data. Bytes are sent as message attachments instead of being
+    encoded into the JSON message.
+    """
+    JSON_SCHEMA = {"type": "string", "contentEncoding": "binary"}
+
+    def json_schema(self):
+        return dict(self.JSON_SCHEMA)
+
+    def checker(self):
+        return lambda x: isinstance(x, (bytes, bytearray))
+
 
 class Parameter(object):
     SIMPLE_TYPE_SCHEMA = {
         str: {"type": "string"},
         int: {"type": "number"},
-        bool: {"type": "boolean"}
+        bool: {"type": "boolean"},
+        bytes: Bytes.JSON_SCHEMA,
     }
 
     def __init__(self, name, desc, schema):
         self.name = name
         self.desc = desc
+        self.static_checker = None
+        self.invalidate_schema()
         if isinstance(schema, type):
-            if schema not in (str, int, bool):
+            if schema not in self.SIMPLE_TYPE_SCHEMA:
                 raise ValueError("Unexpected type for parameter.")
             self.param_schema = self.SIMPLE_TYPE_SCHEMA[schema]
+            self.static_checker = BaseSchema.from_json_schema(
+                self.param_schema).checker()
         elif isinstance(schema, dict):
             # TODO: Validate with meta-schema
             self.param_schema = schema
+            self.static_checker = BaseSchema.from_json_schema(schema).checker()
         elif isinstance(schema, BaseSchema):
             self.param_schema = schema.json_schema()
+            self.static_checker = schema.checker()
         elif callable(schema):
             self.param_schema = schema
 
     @property
-    def schema(self):
-        if callable(self.param_schema):
-            json_schema = self.param_schema()
-            if not isinstance(json_schema, BaseSchema):
+    def dynamic(self):
+        return callable(self.param_schema)
+
+    def invalidate_schema(self):
+        """ Makes a dynamic schema be evaluated again on next use. """
+        self.dynamic_schema = None
+        self.dynamic_json_schema = None
+        self.dynamic_checker = None
+
+    def evaluate_schema(self):
+        if self.dynamic_schema is None:
+            schema = self.param_schema()
+            if not isinstance(schema, BaseSchema):
               raise ValueError("Callable should return a BaseSchema instance")
-            return json_schema.json_schema()
-        return self.param_schema
+            self.dynamic_schema = schema
+        return self.dynamic_schema
+
+    @property
+    def schema(self):
+        if not callable(self.param_schema):
+            return self.param_schema
+
+        if self.dynamic_json_schema is None:
+            self.dynamic_json_schema = self.evaluate_schema().json_schema()
+        return self.dynamic_json_schema
+
+    @property
+    def checker(self):
+        if self.static_checker is not None:
+            return self.static_checker
+
+        if self.dynamic_checker is None:
+            self.dynamic_checker = self.evaluate_schema().checker()
+        return self.dynamic_checker
 
     @property
     def info(self):
@@ -142,9 +286,64 @@ class API(object):
         self.description = desc
         self.args = [x for x in params if x.positional]
         self.kwargs = [x for x in params if not x.positional]
+        self.cached_schema = None
+        self.cached_checker = None
+
+    @property
+    def dynamic(self):
+        return any(x.dynamic for x in self.args + self.kwargs)
+
+    def invalidate_schema(self):
+        """
+        To be called whenever the parameters (or their schemas) change.
+        Dynamic schemas are only evaluated again after this.
+        """
+        self.cached_schema = None
+        self.cached_checker = None
+        for param in self.args + self.kwargs:
+            param.invalidate_schema()
 
     @property
     def schema(self):
+        if self.cached_schema is not None:
+            return self.cached_schema
+
+        self.cached_schema = self.build_schema()
+        return self.cached_schema
+
+    @property
+    def checker(self):
+        """
+        Returns a callable(args, kwargs) that checks a call against the
+        parameters, with the same semantics as validating against the request
+        schema.
+        """
+        if self.cached_checker is not None:
+            return self.cached_checker
+
+        self.cached_checker = self.build_checker()
+        return self.cached_checker
+
+    def build_checker(self):
+        arg_checks = [x.checker for x in self.args]
+        kwarg_checks = [(x.name, x.checker) for x in self.kwargs]
+
+        def check(args, kwargs):
+            if len(args) != len(arg_checks):
+                return False
+            if kwargs and not kwarg_checks:
+                return False
+            for arg, arg_check in zip(args, arg_checks):
+                if not arg_check(arg):
+                    return False
+            for name, kwarg_check in kwarg_checks:
+                if name not in kwargs or not kwarg_check(kwargs[name]):
+                    return False
+            return True
+
+        return check
+
+    def build_schema(self):
         obj = {
             "type": "object",
             "properties": {
@@ -192,9 +391,7 @@ class API(object):
         if kwargs:
             obj["kwargs"] = kwargs
 
-        try:
-            validate(obj, self.schema)
-        except ValidationError:
+        if not self.checker(args, kwargs):
             raise BadArguments("Bad parameters for function call.")
 
         return obj
@@ -202,12 +399,14 @@ class API(object):
     @staticmethod
     def from_info(info):
         try:
-            api = API(info["name"], info["description"], [])
+            return API(info["name"], info["description"],
+                       API.params_from_info(info))
         except KeyError:
             raise BadArguments("Invalid API info object.")
 
-        api.args = [ArgParameter.from_info(x) for x in info.get("args", [])]
-        api.kwargs = [KeywordParameter.from_info(x) for x in
-                      info.get("kwargs", {}).values()]
-
-        return api
+    @staticmethod
+    def params_from_info(info):
+        args = [ArgParameter.from_info(x) for x in info.get("args", [])]
+        kwargs = [KeywordParameter.from_info(x) for x in
+                  info.get("kwargs", {}).values()]
+        return args + kwargs
@@ -0,0 +1,84 @@
+"""
+Result caching for idempotent RPC APIs.
+"""
+
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from threading import Lock
+
+from weavelib.exceptions import BadArguments
+
+
+def cache_key(invocation):
+    return json.dumps([invocation.get("args", []),
+                       invocation.get("kwargs", {})], sort_keys=True,
+                      default=bytes_key)
+
+
+def bytes_key(obj):
+    if not isinstance(obj, (bytes, bytearray)):
+        raise TypeError("Not JSON serializable: " + type(obj).__name__)
+    return {"$bytes": hashlib.sha1(obj).hexdigest()}
+
+
+class CachePolicy(object):
+    """ Results are cached for ttl seconds, with LRU eviction. """
+
+    def __init__(self, ttl, max_entries=128):
+        if ttl <= 0 or max_entries <= 0:
+            raise BadArguments("Bad cache policy.")
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+    @property
+    def info(self):
+        return {"ttl": self.ttl, "max_entries": self.max_entries}
+
+    @staticmethod
+    def from_info(info):
+        try:
+            return CachePolicy(info["ttl"], info["max_entries"])
+        except KeyError:
+            raise BadArguments("Invalid cache policy info object.")
+
+
+class LRUCache(object):
+    def __init__(self, policy):
+        self.policy = policy
+        self.entries = OrderedDict()
+        self.lock = Lock()
+        # Bumped on clear(). Lets callers discard results computed before the
+        # cache was invalidated.
+        self.generation = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        """ Returns a (found, value) tuple. """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return False, None
+            expiry, value = entry
+            if expiry < time.monotonic():
+                del self.entries[key]
+                return False, None
+            self.entries.move_to_end(key)
+            return True, value
+
+    def put(self, key, value, generation=None):
+        with self.lock:
+            if generation is not None and generation != self.generation:
+                return
+            self.entries[key] = (time.monotonic() + self.policy.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.policy.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.generation += 1
@@ -0,0 +1,60 @@
+"""
+Context of the RPC invocation being handled, available to API handlers (and
+anything they call) without having to pass it around.
+"""
+
+import time
+from contextvars import ContextVar, copy_context
+
+
+current_request = ContextVar("current_request", default=None)
+
+
+class RequestContext(object):
+    def __init__(self, caller, request_id, received_at, deadline=None):
+        self.caller = caller
+        self.request_id = request_id
+        self.received_at = received_at
+        self.deadline = deadline
+
+    def remaining(self):
+        """ Seconds left till the deadline (None if there isn't one). """
+        if self.deadline is None:
+            return None
+        return self.deadline - time.time()
+
+    @property
+    def expired(self):
+        return self.deadline is not None and self.deadline <= time.time()
+
+    def run(self, func, *args, **kwargs):
+        """ Runs func with this as the current request context. """
+        token = current_request.set(self)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            current_request.reset(token)
+
+    async def run_coroutine(self, func, *args, **kwargs):
+        # Tasks run in their own copy of the context, so there is nothing to
+        # reset as long as this is the coroutine the task was created for.
+        current_request.set(self)
+        return await func(*args, **kwargs)
+
+
+def get_request_context():
+    """ Returns the RequestContext of the current invocation, or None. """
+    return current_request.get()
+
+
+def propagate_context(func):
+    """
+    Wraps func so that it runs with the current request context, even when
+    called from another thread (say, when submitted to an executor).
+    asyncio tasks inherit the context on their own.
+    """
+    context = copy_context()
+
+    def wrapper(*args, **kwargs):
+        return context.copy().run(func, *args, **kwargs)
+    return wrapper
@@ -0,0 +1,195 @@
+"""
+Receives RPC responses for all RPCClients on a connection.
+"""
+
+import itertools
+import logging
+from functools import partial
+from threading import Lock, Thread, current_thread
+from uuid import uuid4
+try:
+    from Queue import Queue, Empty
+except ImportError:
+    from queue import Queue, Empty
+
+from weavelib.exceptions import ObjectClosed, WeaveException
+from weavelib.messaging import Message
+from weavelib.messaging.messaging import MessageWaiter, ensure_ok_message
+
+
+logger = logging.getLogger(__name__)
+
+
+class ChannelSession(object):
+    def __init__(self, channel):
+        self.channel = channel
+        self.session_id = "demux-session-" + str(uuid4())
+        self.cookie = "rpc-client-cookie-" + str(uuid4())
+        self.clients = []
+        self.popping = False
+
+
+class ResponseDemux(object):
+    """
+    Keeps at most one pop outstanding per response queue, and hands each
+    response to the client that is waiting for it. Responses and client
+    callbacks are handled on a single thread, no matter how many RPCs (and
+    clients of them) are used.
+
+    Clients of the same response queue share a cookie. A new cookie is used
+    once all of them are gone, so that a pop left outstanding by them can't
+    take responses meant for later clients.
+
+    Pending calls of the clients fail if their response queue can't be read
+    from, or once the connection is closed.
+    """
+    PUMP_INTERVAL = 0.1
+    STOP = object()
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.items = Queue()
+        self.sessions = {}
+        self.lock = Lock()
+        self.thread = None
+        self.request_ids = itertools.count()
+
+    def subscribe(self, channel, client):
+        """ Returns the cookie to send requests with. """
+        with self.lock:
+            if self.thread is None:
+                self.thread = Thread(target=self.run, daemon=True)
+                self.thread.start()
+            session = self.sessions.get(channel)
+            if session is None:
+                session = ChannelSession(channel)
+                self.sessions[channel] = session
+                self.conn.add_reader(session.session_id,
+                                     partial(self.on_message, session))
+            session.clients.append(client)
+        self.pop(session)
+        return session.cookie
+
+    def next_request_id(self):
+        """ Returns a short request ID, unique across the clients. """
+        with self.lock:
+            return next(self.request_ids)
+
+    def unsubscribe(self, channel, client):
+        with self.lock:
+            session = self.sessions.get(channel)
+            if session is None or client not in session.clients:
+                return
+            session.clients.remove(client)
+            if not session.clients:
+                del self.sessions[channel]
+                self.conn.remove_reader(session.session_id)
+
+    def pop(self, session):
+        with self.lock:
+            if session.popping or self.sessions.get(session.channel) \
+                    is not session:
+                return
+            session.popping = True
+
+        msg = Message("pop")
+        msg.headers["SESS"] = session.session_id
+        msg.headers["C"] = session.channel
+        msg.headers["COOKIE"] = session.cookie
+        try:
+            self.conn.send_internal(msg)
+        except IOError:
+            with self.lock:
+                session.popping = False
+
+    def on_message(self, session, msg):
+        self.items.put((session, msg))
+
+    def close(self):
+        """ Stops the demultiplexer once the queued responses are handled. """
+        with demuxes_lock:
+            if demuxes.get(self.conn) is self:
+                del demuxes[self.conn]
+        self.items.put(self.STOP)
+
+    def run(self):
+        while True:
+            item = self.items.get()
+            if item is self.STOP:
+                return
+            self.dispatch(item)
+
+    def dispatch(self, item):
+        session, msg = item
+        with self.lock:
+            session.popping = False
+        if msg is MessageWaiter.CONNECTION_CLOSED:
+            self.fail(session, "ObjectClosed", "Connection closed.")
+            return
+
+        if msg.op != "inform":
+            try:
+                ensure_ok_message(msg)
+            except WeaveException as e:
+                logger.error("Unable to receive from %s: %s", session.channel,
+                             e.err_msg())
+                self.fail(session, e.err_msg(), e.extra)
+                return
+            self.pop(session)
+            return
+
+        self.pop(session)
+
+        with self.lock:
+            clients = list(session.clients)
+
+        response = msg.task
+        if "invalidate" in response:
+            for client in clients:
+                client.on_rpc_message(response, msg.headers)
+            return
+
+        for client in clients:
+            if response.get("id") in client.pending:
+                client.on_rpc_message(response, msg.headers)
+                return
+
+    def fail(self, session, error_name, error):
+        with self.lock:
+            clients = list(session.clients)
+        for client in clients:
+            client.pending.fail_all(error_name, error)
+
+    def wait(self, future):
+        """
+        Returns the result of the future. When called from a response
+        callback, keeps dispatching responses while waiting, so that a
+        blocking call can be made from a callback.
+        """
+        if current_thread() is not self.thread:
+            return future.result()
+
+        while not future.done():
+            try:
+                item = self.items.get(timeout=self.PUMP_INTERVAL)
+            except Empty:
+                continue
+            if item is self.STOP:
+                # Leave it for run().
+                self.items.put(item)
+                raise ObjectClosed("Connection closed.")
+            self.dispatch(item)
+        return future.result()
+
+
+demuxes = {}
+demuxes_lock = Lock()
+
+
+def get_demux(conn):
+    with demuxes_lock:
+        if conn not in demuxes:
+            demux = ResponseDemux(conn)
+            demuxes[conn] = demux
+            conn.add_close_listener(demux.close)
+        return demuxes[conn]
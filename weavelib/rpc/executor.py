@@ -0,0 +1,166 @@
+"""
+Per-API dispatch of RPC invocations on to the executors of an RPCServer.
+"""
+
+import asyncio
+import time
+from collections import deque
+from concurrent.futures import Future
+from threading import Lock
+
+
+def copy_future_state(source, destination):
+    if not destination.set_running_or_notify_cancel():
+        return
+    exception = source.exception()
+    if exception is not None:
+        destination.set_exception(exception)
+    else:
+        destination.set_result(source.result())
+
+
+class APIExecutor(object):
+    """
+    Dispatches invocations of a single API to an underlying executor (the
+    shared thread pool, a process pool or the server's event loop) while
+    ensuring no more than max_concurrency of them run at a time. The rest
+    wait in FIFO order.
+
+    submit_func(fn, *args, **kwargs) should schedule fn on the underlying
+    executor and return a concurrent.futures.Future. If track_start is True,
+    fn is wrapped to measure the time spent before it actually started (say,
+    behind other APIs in the thread pool), and the time it ran for.
+    Otherwise, wait time is measured till submit_func is called.
+    """
+    # Weight of the latest sample in the moving average of run times.
+    RUN_TIME_ALPHA = 0.2
+
+    def __init__(self, submit_func, max_concurrency=None, track_start=True,
+                 metrics=None):
+        self.submit_func = submit_func
+        self.metrics = metrics
+        self.max_concurrency = max_concurrency
+        self.track_start = track_start
+        self.lock = Lock()
+        self.queue = deque()
+        self.running = 0
+        self.submitted = 0
+        self.started = 0
+        self.completed = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.avg_run_time = 0.0
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        item = (future, fn, args, kwargs, time.time())
+        with self.lock:
+            self.submitted += 1
+            if self.max_concurrency and self.running >= self.max_concurrency:
+                self.queue.append(item)
+                return future
+            self.running += 1
+
+        self.dispatch(item)
+        return future
+
+    def dispatch(self, item):
+        future, fn, args, kwargs, queued_at = item
+        started_at = None
+        if not self.track_start:
+            started_at = self.record_start(queued_at)
+        elif asyncio.iscoroutinefunction(fn):
+            fn = self.wrap_coroutine(fn, queued_at)
+        else:
+            fn = self.wrap(fn, queued_at)
+
+        try:
+            inner = self.submit_func(fn, *args, **kwargs)
+        except Exception as e:
+            inner = Future()
+            inner.set_exception(e)
+
+        inner.add_done_callback(lambda x: self.on_done(future, x, started_at))
+
+    def wrap(self, fn, queued_at):
+        def execute(*args, **kwargs):
+            started_at = self.record_start(queued_at)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.record_run_time(time.time() - started_at)
+        return execute
+
+    def wrap_coroutine(self, fn, queued_at):
+        async def execute(*args, **kwargs):
+            started_at = self.record_start(queued_at)
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                self.record_run_time(time.time() - started_at)
+        return execute
+
+    def record_start(self, queued_at):
+        now = time.time()
+        wait = now - queued_at
+        with self.lock:
+            self.started += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+        if self.metrics is not None:
+            self.metrics.queue_wait.record(wait)
+        return now
+
+    def record_run_time(self, run_time):
+        if self.metrics is not None:
+            self.metrics.run_time.record(run_time)
+        with self.lock:
+            if not self.avg_run_time:
+                self.avg_run_time = run_time
+            else:
+                self.avg_run_time += self.RUN_TIME_ALPHA * \
+                    (run_time - self.avg_run_time)
+
+    def record_rejection(self):
+        with self.lock:
+            self.rejected += 1
+
+    def on_done(self, future, inner, started_at=None):
+        if started_at is not None:
+            self.record_run_time(time.time() - started_at)
+
+        with self.lock:
+            self.completed += 1
+            if self.queue:
+                item = self.queue.popleft()
+            else:
+                item = None
+                self.running -= 1
+
+        if item is not None:
+            self.dispatch(item)
+        copy_future_state(inner, future)
+
+    @property
+    def queue_depth(self):
+        return len(self.queue)
+
+    @property
+    def waiting(self):
+        """ Number of invocations submitted, but not started yet. """
+        return self.submitted - self.started
+
+    def stats(self):
+        with self.lock:
+            return {
+                "max_concurrency": self.max_concurrency,
+                "queue_depth": len(self.queue),
+                "running": self.running,
+                "completed": self.completed,
+                "avg_wait": self.total_wait / self.started if self.started
+                            else 0.0,
+                "max_wait": self.max_wait,
+                "avg_run_time": self.avg_run_time,
+                "rejected": self.rejected,
+            }
@@ -0,0 +1,123 @@
+"""
+Low-overhead latency and size instrumentation of RPC APIs.
+"""
+
+from bisect import bisect_left
+from threading import Lock
+
+from weavelib.messaging.messaging import dump_json
+
+
+class Histogram(object):
+    """
+    Counts values in exponentially sized buckets: the first bucket holds
+    values up to `start`, and each bucket after that is `factor` times as
+    large. Percentiles are estimated as the upper bound of the bucket they
+    fall in.
+    """
+
+    def __init__(self, start, factor=2, num_buckets=32):
+        self.bounds = [start * factor ** i for i in range(num_buckets)]
+        self.counts = [0] * (num_buckets + 1)
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+        self.lock = Lock()
+
+    def record(self, value):
+        index = bisect_left(self.bounds, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.total += value
+            if self.min is None or value < self.min:
+                self.min = value
+            if self.max is None or value > self.max:
+                self.max = value
+
+    def percentile(self, percentile):
+        with self.lock:
+            return self.percentile_internal(percentile)
+
+    def percentile_internal(self, percentile):
+        if not self.count:
+            return None
+        rank = self.count * percentile / 100.0
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                if index == len(self.bounds):
+                    return self.max
+                return min(self.bounds[index], self.max)
+        return self.max
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "count": self.count,
+                "mean": self.total / self.count if self.count else None,
+                "min": self.min,
+                "max": self.max,
+                "p50": self.percentile_internal(50),
+                "p90": self.percentile_internal(90),
+                "p99": self.percentile_internal(99),
+            }
+
+
+def time_histogram():
+    """ Buckets from 10us to ~6 hours. """
+    return Histogram(0.00001, num_buckets=32)
+
+
+def size_histogram():
+    """ Buckets from 16 bytes to 32GB. """
+    return Histogram(16, num_buckets=32)
+
+
+def payload_size(obj):
+    """ Size of obj as sent: its JSON, plus bytes sent as attachments. """
+    attachments = []
+    return len(dump_json(obj, attachments)) + sum(map(len, attachments))
+
+
+class APIMetrics(object):
+    """
+    Queue wait, execution time, response send time (in seconds), errors and
+    payload sizes (in bytes, of encoded arguments and results) of an
+    API. Payload sizes are sampled for one in SIZE_SAMPLE_RATE invocations,
+    since measuring requires encoding the payload again.
+    """
+    SIZE_SAMPLE_RATE = 16
+
+    def __init__(self):
+        self.queue_wait = time_histogram()
+        self.run_time = time_histogram()
+        self.send_time = time_histogram()
+        self.request_size = size_histogram()
+        self.response_size = size_histogram()
+        self.errors = 0
+        self.invocations = 0
+        self.lock = Lock()
+
+    def record_invocation(self):
+        """ Returns True if the payload sizes should be sampled. """
+        with self.lock:
+            self.invocations += 1
+            return self.invocations % self.SIZE_SAMPLE_RATE == 1
+
+    def record_error(self):
+        with self.lock:
+            self.errors += 1
+
+    def snapshot(self):
+        return {
+            "invocations": self.invocations,
+            "errors": self.errors,
+            "queue_wait": self.queue_wait.snapshot(),
+            "run_time": self.run_time.snapshot(),
+            "send_time": self.send_time.snapshot(),
+            "request_size": self.request_size.snapshot(),
+            "response_size": self.response_size.snapshot(),
+        }
@@ -0,0 +1,117 @@
+"""
+Book-keeping of RPC invocations that are awaiting a response.
+"""
+
+import heapq
+import itertools
+import logging
+import time
+from collections import OrderedDict
+from threading import Condition, Lock, Thread
+
+
+logger = logging.getLogger(__name__)
+
+
+class ExpiryScheduler(object):
+    """ Runs functions at (absolute, time.time()) deadlines on one thread. """
+
+    def __init__(self):
+        self.heap = []
+        self.counter = itertools.count()
+        self.cond = Condition()
+        self.thread = None
+
+    def schedule(self, deadline, func, *args):
+        with self.cond:
+            heapq.heappush(self.heap, (deadline, next(self.counter), func,
+                                       args))
+            if self.thread is None:
+                self.thread = Thread(target=self.run, daemon=True)
+                self.thread.start()
+            self.cond.notify()
+
+    def run(self):
+        while True:
+            with self.cond:
+                while not self.heap:
+                    self.cond.wait()
+                wait_time = self.heap[0][0] - time.time()
+                if wait_time > 0:
+                    self.cond.wait(wait_time)
+                    continue
+                _, _, func, args = heapq.heappop(self.heap)
+
+            try:
+                func(*args)
+            except Exception:
+                logger.exception("Scheduled function failed.")
+
+
+scheduler = ExpiryScheduler()
+
+
+def error_response(msg_id, error_name, error):
+    return {"id": msg_id, "error_name": error_name, "error": error}
+
+
+class PendingCalls(object):
+    """
+    Response callbacks keyed by message ID. Calls that are past their
+    deadline are completed with a TimedOut response. Beyond max_size, the
+    oldest calls are dropped the same way.
+    """
+    DEFAULT_MAX_SIZE = 10000
+
+    def __init__(self, max_size=DEFAULT_MAX_SIZE):
+        self.max_size = max_size
+        self.calls = OrderedDict()
+        self.lock = Lock()
+
+    def __len__(self):
+        return len(self.calls)
+
+    def __contains__(self, msg_id):
+        return msg_id in self.calls
+
+    def add(self, msg_id, callback, deadline=None):
+        with self.lock:
+            self.calls[msg_id] = (callback, deadline)
+            evicted = []
+            while len(self.calls) > self.max_size:
+                evicted.append(self.calls.popitem(last=False))
+
+        if deadline is not None:
+            scheduler.schedule(deadline, self.expire, msg_id, deadline)
+
+        for evicted_id, (evicted_callback, _) in evicted:
+            evicted_callback(error_response(evicted_id, "TimedOut",
+                                            "Too many pending calls."))
+
+    def get(self, msg_id):
+        with self.lock:
+            callback, _ = self.calls.get(msg_id, (None, None))
+            return callback
+
+    def pop(self, msg_id):
+        with self.lock:
+            callback, _ = self.calls.pop(msg_id, (None, None))
+            return callback
+
+    def expire(self, msg_id, deadline):
+        with self.lock:
+            # The call might have been re-added with a new deadline.
+            entry = self.calls.get(msg_id)
+            if entry is None or entry[1] != deadline:
+                return
+            del self.calls[msg_id]
+
+        entry[0](error_response(msg_id, "TimedOut", "Deadline exceeded."))
+
+    def fail_all(self, error_name, error):
+        with self.lock:
+            calls = list(self.calls.items())
+            self.calls.clear()
+
+        for msg_id, (callback, _) in calls:
+            callback(error_response(msg_id, error_name, error))
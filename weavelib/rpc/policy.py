@@ -0,0 +1,93 @@
+"""
+Policies for retrying and hedging invocations of idempotent APIs.
+"""
+
+from collections import deque
+from threading import Lock
+
+from weavelib.exceptions import BadArguments
+
+
+class RetryPolicy(object):
+    """
+    Calls that time out are retried (with the same request ID) after an
+    exponential backoff, for up to max_attempts attempts in all. Each attempt
+    gets the timeout of the call, within the deadline of the request the call
+    was made from (if any).
+    """
+
+    def __init__(self, max_attempts=3, backoff=0.1, multiplier=2,
+                 max_backoff=2.0):
+        if max_attempts < 1 or backoff < 0 or multiplier < 1:
+            raise BadArguments("Bad retry policy.")
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.multiplier = multiplier
+        self.max_backoff = max_backoff
+
+    def delay(self, attempt):
+        """ Returns the backoff after the given (1-based) failed attempt. """
+        return min(self.backoff * self.multiplier ** (attempt - 1),
+                   self.max_backoff)
+
+
+class HedgePolicy(object):
+    """
+    A duplicate of a call is sent if it hasn't completed within the given
+    percentile of recently observed latencies (but no sooner than min_delay
+    seconds). The first response wins. No hedging happens till min_samples
+    latencies have been observed.
+    """
+
+    def __init__(self, percentile=95, min_delay=0.01, max_hedges=1,
+                 window=128, min_samples=10):
+        if not 0 < percentile <= 100 or max_hedges < 1 or window < 1:
+            raise BadArguments("Bad hedge policy.")
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.max_hedges = max_hedges
+        self.min_samples = min(min_samples, window)
+        self.latencies = deque(maxlen=window)
+        self.lock = Lock()
+
+    def record(self, latency):
+        with self.lock:
+            self.latencies.append(latency)
+
+    def delay(self):
+        """ Returns seconds to wait before hedging, or None to not hedge. """
+        with self.lock:
+            if len(self.latencies) < self.min_samples:
+                return None
+            samples = sorted(self.latencies)
+
+        index = min(len(samples) - 1,
+                    int(len(samples) * self.percentile / 100.0))
+        return max(self.min_delay, samples[index])
+
+
+class AdmissionPolicy(object):
+    """
+    RPCServer rejects invocations with Overloaded (instead of queueing them)
+    when more than max_queue_length invocations are waiting to start, or
+    when the estimated wait exceeds max_wait seconds or the time left till
+    the deadline of the invocation.
+    """
+
+    def __init__(self, max_queue_length=None, max_wait=None):
+        if (max_queue_length is not None and max_queue_length < 0) or \
+                (max_wait is not None and max_wait <= 0):
+            raise BadArguments("Bad admission policy.")
+        self.max_queue_length = max_queue_length
+        self.max_wait = max_wait
+
+    def check(self, queue_length, estimated_wait, time_left=None):
+        """ Returns the reason to reject an invocation, or None. """
+        if self.max_queue_length is not None and \
+                queue_length >= self.max_queue_length:
+            return "Too many queued invocations."
+        if self.max_wait is not None and estimated_wait > self.max_wait:
+            return "Estimated wait is too long."
+        if time_left is not None and estimated_wait > time_left:
+            return "Invocation would miss its deadline."
+        return None
@@ -0,0 +1,82 @@
+"""
+Replicas of an RPCServer in worker processes.
+"""
+
+import multiprocessing
+import os
+import queue
+
+from weavelib.exceptions import BadArguments, InternalError, TimedOut
+from weavelib.messaging import WeaveConnection
+
+
+def run_replica(factory, address, token, rpc_info, ready, stop_event):
+    conn = WeaveConnection(address[0], address[1], auto_discover=False)
+    try:
+        conn.connect()
+        server = factory(conn, token, rpc_info)
+        server.start()
+    except Exception as e:
+        ready.put(repr(e))
+        if conn.active:
+            conn.close()
+        return
+
+    ready.put(None)
+    stop_event.wait()
+    server.stop()
+    conn.close()
+
+
+class ReplicaPool(object):
+    """
+    Runs replicas of a started RPCServer in worker processes, so that an RPC
+    isn't limited to a single core. factory(conn, token, rpc_info) is called
+    in every worker (so it must be picklable), and should return an RPCServer
+    created with replica_of=rpc_info. Stop the pool before the primary.
+    """
+    START_TIMEOUT = 30
+
+    def __init__(self, factory, num_replicas=None):
+        self.factory = factory
+        self.num_replicas = num_replicas or os.cpu_count()
+        self.context = multiprocessing.get_context("spawn")
+        self.stop_event = self.context.Event()
+        self.processes = []
+
+    def start(self, server):
+        # Stream acks go to the shared request queue, and can't be routed
+        # back to the replica serving the stream.
+        if any(api.streaming for api in server.apis.values()):
+            raise BadArguments("Streaming APIs can't be replicated.")
+
+        conn = server.service.get_connection()
+        address = conn.sock.getpeername()[:2]
+        token = server.service.get_auth_token()
+        rpc_info = server.info_message
+
+        ready = self.context.Queue()
+        for _ in range(self.num_replicas):
+            process = self.context.Process(
+                target=run_replica,
+                args=(self.factory, address, token, rpc_info, ready,
+                      self.stop_event),
+                daemon=True)
+            process.start()
+            self.processes.append(process)
+
+        for _ in range(self.num_replicas):
+            try:
+                error = ready.get(timeout=self.START_TIMEOUT)
+            except queue.Empty:
+                self.stop()
+                raise TimedOut("Replicas did not start.")
+            if error is not None:
+                self.stop()
+                raise InternalError("Replica failed to start: " + error)
+
+    def stop(self):
+        self.stop_event.set()
+        for process in self.processes:
+            process.join()
+        self.processes = []
@@ -1,16 +1,30 @@
+import asyncio
 import inspect
 import logging
-from concurrent.futures import ThreadPoolExecutor
-from threading import Thread, RLock, Event
+import multiprocessing
+import os
+import pickle
+import time
+from collections import OrderedDict
+from functools import partial
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from threading import Event, Thread, Lock, RLock
 from uuid import uuid4
 
-from jsonschema import Draft4Validator
-
 from weavelib.messaging import Sender, Receiver
 from weavelib.messaging.messaging import raise_message_exception
-from weavelib.exceptions import WeaveException, BadArguments
+from weavelib.exceptions import WeaveException, BadArguments, TimedOut
+from weavelib.exceptions import Overloaded, BadOperation
 from weavelib.services import MessagingEnabled
-from .api import API, ArgParameter, KeywordParameter
+from .api import API, fingerprint
+from .cache import CachePolicy, LRUCache, cache_key
+from .context import RequestContext, get_request_context
+from .demux import get_demux
+from .executor import APIExecutor
+from .metrics import APIMetrics, payload_size
+from .pending import PendingCalls, error_response, scheduler
+from .stream import ServerStream, ResponseStream, chunked, chunked_async
+from .stream import iterate_in_context
 
 
 logger = logging.getLogger(__name__)
@@ -23,37 +37,208 @@ def api_group_schema(apis):
     }
 
 
+def future_callback(future, extract_func):
+    """ Returns a response callback that resolves the future. """
+    def callback(response):
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            result = extract_func(response)
+        except Exception as e:
+            future.set_exception(e)
+        else:
+            future.set_result(result)
+    return callback
+
+
 class RemoteAPIError(RuntimeError):
     """Raised to indicate exception thrown by remote API."""
 
 
+# Parsed parameters of API info, keyed by fingerprint. These are shared by
+# ClientAPIs (of all RPCClients) built from the same API info.
+parsed_params = OrderedDict()
+parsed_params_lock = Lock()
+MAX_PARSED_PARAMS = 1024
+
+
+def parse_params(info):
+    key = info.get("fingerprint")
+    if key is None:
+        return API.params_from_info(info)
+
+    with parsed_params_lock:
+        params = parsed_params.get(key)
+        if params is not None:
+            parsed_params.move_to_end(key)
+            return params
+
+    params = API.params_from_info(info)
+    with parsed_params_lock:
+        parsed_params[key] = params
+        while len(parsed_params) > MAX_PARSED_PARAMS:
+            parsed_params.popitem(last=False)
+    return params
+
+
+def set_timeout(request, deadline):
+    """ Stamps the request with the seconds left till the deadline. """
+    if deadline is not None:
+        request["timeout"] = max(deadline - time.time(), 0)
+
+
+# Hedges and retries are scheduled on the ExpiryScheduler thread, but sent
+# from these, as sending blocks.
+resend_executor = ThreadPoolExecutor(4)
+
+
+def resend(func, *args):
+    def run():
+        try:
+            func(*args)
+        except Exception:
+            logger.exception("Unable to resend request.")
+    resend_executor.submit(run)
+
+
+def kwarg_names(api):
+    """ Names of the keyword parameters, in the order compact calls use. """
+    return sorted(x.name for x in api.kwargs)
+
+
+# RPCServers of this process that accept in-process calls, by request queue.
+local_servers = {}
+local_servers_lock = Lock()
+
+
 class ClientAPI(API):
-    def __init__(self, name, desc, params, handler):
+    def __init__(self, name, desc, params, handler, cache_policy=None,
+                 idempotent=False, hedge_policy=None, retry_policy=None,
+                 streaming=False, index=None):
         super(ClientAPI, self).__init__(name, desc, params)
         self.handler = handler
-
-    def __call__(self, *args, _block=False, _callback=None, **kwargs):
+        # Set if the server accepts compact calls (see RPCServer).
+        self.index = index
+        self.cache_policy = cache_policy
+        self.result_cache = LRUCache(cache_policy) if cache_policy else None
+        self.idempotent = idempotent
+        self.streaming = streaming
+        # Override the policies of RPCClient for this API.
+        self.hedge_policy = hedge_policy
+        self.retry_policy = retry_policy
+
+    def __call__(self, *args, _block=False, _callback=None, _future=False,
+                 _async=False, _timeout=None, **kwargs):
+        """
+        By default, the call is fire-and-forget. Pass in one of:
+          _block=True: Wait for and return the result (or raise the error).
+          _callback=func: func(response) is invoked with the raw response.
+          _future=True: Return a concurrent.futures.Future for the result.
+          _async=True: Return an asyncio future that can be awaited upon
+                       within the event loop of the calling thread.
+
+        _timeout (in seconds) sets a deadline for the call. The server skips
+        the call if it is past its deadline, and waiting callers get a
+        TimedOut error.
+
+        Streaming APIs always return an iterator over the results.
+        """
         obj = self.validate_call(*args, **kwargs)
-        return self.handler(obj, block=_block, callback=_callback)
+        if self.streaming:
+            if _callback or _future or _async:
+                raise BadArguments("Streaming APIs return an iterator.")
+            return self.handler(obj, block=False, callback=None,
+                                timeout=_timeout)
+        if _future or _async:
+            future = Future()
+            self.handler(obj, block=False,
+                         callback=future_callback(future, extract_rpc_payload),
+                         timeout=_timeout)
+            return asyncio.wrap_future(future) if _async else future
+        return self.handler(obj, block=_block, callback=_callback,
+                            timeout=_timeout)
 
     @staticmethod
     def from_info(info, handler):
-        api = ClientAPI(info["name"], info["description"], [], handler)
-        api.args = [ArgParameter.from_info(x) for x in info.get("args", [])]
-        api.kwargs = [KeywordParameter.from_info(x) for x in
-                      info.get("kwargs", {}).values()]
-        return api
+        cache_policy = None
+        if info.get("cache"):
+            cache_policy = CachePolicy.from_info(info["cache"])
+        return ClientAPI(info["name"], info["description"],
+                         parse_params(info), handler,
+                         cache_policy=cache_policy,
+                         idempotent=info.get("idempotent", False),
+                         streaming=info.get("stream", False),
+                         index=info.get("index"))
 
 
 class ServerAPI(API):
-    def __init__(self, name, desc, params, handler):
+    """
+    max_concurrency limits the number of invocations of this API that run
+    at a time, so that an expensive API can not hog all the workers of the
+    RPCServer. With use_processes=True, the handler runs in a pool of
+    max_concurrency (default: CPU count) worker processes, for CPU-bound
+    APIs. Such handlers must be picklable (module level functions). They run
+    with the request context set, so get_rpc_caller() and
+    get_request_context() work as usual.
+
+    A CachePolicy can be passed in for APIs whose results depend only on
+    their arguments. Results are then cached by the server and, since the
+    policy is published in API info, memoized by clients, too. Use
+    RPCServer.invalidate_cache(..) when the underlying data changes.
+
+    idempotent=True marks APIs that are safe to invoke more than once, which
+    lets clients retry and hedge calls. Duplicate requests (by request ID)
+    are answered from the original invocation.
+
+    Generator (and async generator) handlers stream their items to the
+    client, stream_chunk_size items per message. Clients get an iterator,
+    which should be closed if it isn't exhausted: until then, the stream of a
+    synchronous handler holds on to one of the RPCServer's workers.
+    """
+    def __init__(self, name, desc, params, handler, max_concurrency=None,
+                 use_processes=False, cache_policy=None, idempotent=False,
+                 stream_chunk_size=32):
         super(ServerAPI, self).__init__(name, desc, params)
         self.handler = handler
+        self.idempotent = idempotent
+        self.cache_policy = cache_policy
+        self.result_cache = LRUCache(cache_policy) if cache_policy else None
+        self.streaming = inspect.isgeneratorfunction(handler) or \
+            inspect.isasyncgenfunction(handler)
+        self.stream_chunk_size = stream_chunk_size
+        # Coroutine handlers run on the RPCServer's event loop.
+        self.is_coroutine = asyncio.iscoroutinefunction(handler) or \
+            inspect.isasyncgenfunction(handler)
+        self.max_concurrency = max_concurrency
+        self.use_processes = use_processes
+
+        if self.streaming and (use_processes or idempotent or cache_policy):
+            raise BadArguments("Streaming APIs can not use process pools, "
+                               "caching or be idempotent.")
+
+        if use_processes:
+            if self.is_coroutine:
+                raise BadArguments("Coroutines can not use process pools.")
+            try:
+                pickle.dumps(handler)
+            except Exception:
+                raise BadArguments("Handler should be picklable.")
 
     def __call__(self, *args, **kwargs):
         self.validate_call(*args, **kwargs)
         return self.handler(*args, **kwargs)
 
+    @property
+    def info(self):
+        info = super(ServerAPI, self).info
+        if self.cache_policy is not None:
+            info["cache"] = self.cache_policy.info
+        if self.idempotent:
+            info["idempotent"] = True
+        if self.streaming:
+            info["stream"] = True
+        return info
+
 
 class RPC(object):
     def __init__(self, name, description, apis):
@@ -88,16 +273,75 @@ class RPCReceiver(Receiver):
 
 
 class RPCServer(RPC):
+    """
+    Pass in an AdmissionPolicy to shed load: invocations that would wait too
+    long are then rejected right away with an Overloaded error.
+
+    Latency, error and payload size metrics of every API are available
+    through stats(), and to clients through the reserved "_rpc_stats" API.
+
+    Pass in the info_message of a started RPCServer as replica_of to serve
+    the same RPC from another instance (see ReplicaPool). Replicas compete for
+    requests on the primary's queues, and leave registration to the primary.
+    Caches, deduplication, streams and metrics are local to each replica.
+
+    With compact=True, every API is given an index in its info, and clients
+    may then send invocations as {"call": [index, request ID, values]}, with
+    an integer request ID, and the values of the args followed by those of
+    the kwargs in the order of their names.
+
+    With allow_local=True, RPCClients in the same process that use the same
+    auth token call the server directly instead of through the message
+    server. Such calls are still validated and executed as usual, but
+    arguments and results are not copied (so must not be modified), and
+    get_rpc_caller() returns None.
+    """
+    STATS_API = "_rpc_stats"
     MAX_RPC_WORKERS = 5
+    MAX_CACHE_COOKIES = 1024
+    # Responses of idempotent APIs are kept around to answer duplicates.
+    DEDUPE_POLICY = CachePolicy(60, max_entries=1024)
+    # Streams fail with TimedOut if the client doesn't ask for more for this
+    # long. A synchronous stream holds on to an RPC worker while it waits.
+    STREAM_ACK_TIMEOUT = 30
 
     def __init__(self, name, description, apis, service,
-                 allowed_requestors=None):
+                 allowed_requestors=None, admission_policy=None,
+                 replica_of=None, compact=False, allow_local=False):
         if not isinstance(service, MessagingEnabled):
             raise BadArguments("Service is not messaging enabled.")
 
+        if any(x.name == self.STATS_API for x in apis):
+            raise BadArguments("Reserved API name: " + self.STATS_API)
+        apis = list(apis) + [
+            ServerAPI(self.STATS_API, "Returns metrics of every API.", [],
+                      self.stats)
+        ]
+
         super(RPCServer, self).__init__(name, description, apis)
+        self.admission_policy = admission_policy
+        self.replica_of = replica_of
+        self.api_index = sorted(self.apis) if compact else None
+        self.allow_local = allow_local
+        self.metrics = {name: APIMetrics() for name in self.apis}
+        self.api_infos = {}
         self.service = service
         self.executor = ThreadPoolExecutor(self.MAX_RPC_WORKERS)
+        # Responses of coroutine handlers are sent from here, since sending
+        # blocks, and would stall every coroutine on the event loop.
+        self.response_executor = ThreadPoolExecutor(self.MAX_RPC_WORKERS)
+        self.loop = None
+        self.loop_thread = None
+        self.process_pools = []
+        self.api_executors = {}
+        # Response cookies of clients that may have memoized results.
+        self.cache_cookies = OrderedDict()
+        self.cache_cookies_lock = Lock()
+        self.inflight = {}
+        self.recent_responses = LRUCache(self.DEDUPE_POLICY)
+        self.dedupe_lock = Lock()
+        self.streams = {}
+        self.streams_lock = Lock()
         self.sender = None
         self.receiver = None
         self.receiver_thread = None
@@ -105,38 +349,198 @@ class RPCServer(RPC):
         self.appmgr_client = None
         self.allowed_requestors = allowed_requestors or []
 
+    def build_api_infos(self, previous=None):
+        """
+        Returns the info of every API, with a fingerprint of its content.
+        Only dynamic APIs are rebuilt if previous infos are given.
+        """
+        infos = {}
+        for name, api in self.apis.items():
+            if previous and name in previous and not api.dynamic:
+                infos[name] = previous[name]
+                continue
+            info = api.info
+            if self.api_index is not None:
+                info["index"] = self.api_index.index(name)
+            info["fingerprint"] = fingerprint(info)
+            infos[name] = info
+        return infos
+
     def register_rpc(self):
-        apis = {name: api.info for name, api in self.apis.items()}
+        self.api_infos = self.build_api_infos()
         # TODO: This means one extra RC for every registration. Clean up.
         result = self.appmgr_client["register_rpc"](self.name, self.description,
-                                                    apis,
+                                                    self.api_infos,
                                                     self.allowed_requestors,
                                                     _block=True)
         return result
 
     def update_rpc(self, callback=None):
-        apis = {name: api.info for name, api in self.apis.items()}
-        return self.appmgr_client["update_rpc"](self.name, apis,
-                                                _block=(not callback),
-                                                _callback=callback)
+        """
+        Evaluates dynamic schemas again, and sends API info to the registry
+        unless none of the fingerprints changed. The registry replaces the
+        whole API map, so the info of every API is sent.
+
+        Dynamic schemas are memoized, so this must be called whenever they
+        change, even if they're only used to validate calls.
+        """
+        if self.replica_of is not None:
+            raise BadOperation("Only the primary can update the RPC.")
+
+        for api in self.apis.values():
+            if api.dynamic:
+                api.invalidate_schema()
+
+        api_infos = self.build_api_infos(self.api_infos)
+        unchanged = {x: y["fingerprint"] for x, y in api_infos.items()} == \
+            {x: y["fingerprint"] for x, y in self.api_infos.items()}
+        if unchanged:
+            if callback:
+                callback({"id": None, "command": "update_rpc",
+                          "result": True})
+                return
+            return True
+
+        # Only kept once the registry has them, so that a failed update is
+        # sent again next time.
+        update_api = self.appmgr_client["update_rpc"]
+        if not callback:
+            result = update_api(self.name, api_infos, _block=True)
+            self.api_infos = api_infos
+            return result
+
+        def on_response(response):
+            if "result" in response:
+                self.api_infos = api_infos
+            callback(response)
+
+        update_api(self.name, api_infos, _callback=on_response)
 
     def start(self):
         conn = self.service.get_connection()
         auth_token = self.service.get_auth_token()
-        self.appmgr_client = self.get_appmgr_client()
-        self.appmgr_client.start()
-
-        rpc_info = self.register_rpc()
+        if self.replica_of is None:
+            self.appmgr_client = self.get_appmgr_client()
+            self.appmgr_client.start()
+            rpc_info = self.register_rpc()
+        else:
+            self.api_infos = self.build_api_infos()
+            rpc_info = self.replica_of
         self.sender = Sender(conn, rpc_info["response_queue"], auth=auth_token)
         self.receiver = RPCReceiver(conn, self, rpc_info["request_queue"],
                                     auth=auth_token)
 
+        if any(api.is_coroutine for api in self.apis.values()):
+            self.loop = asyncio.new_event_loop()
+            self.loop_thread = Thread(target=self.loop.run_forever)
+            self.loop_thread.start()
+
+        self.api_executors = {name: self.create_api_executor(api)
+                              for name, api in self.apis.items()}
+
         self.sender.start()
         self.receiver.start()
 
         self.receiver_thread = Thread(target=self.receiver.run)
         self.receiver_thread.start()
 
+        if self.allow_local:
+            with local_servers_lock:
+                local_servers[rpc_info["request_queue"]] = self
+
+    def create_api_executor(self, api):
+        metrics = self.metrics[api.name]
+        if api.use_processes:
+            pool = ProcessPoolExecutor(
+                api.max_concurrency or os.cpu_count(),
+                mp_context=multiprocessing.get_context("spawn"))
+            self.process_pools.append(pool)
+
+            def submit(fn, context, handler, *args, **kwargs):
+                # Validated here, since the handler runs in another process.
+                api.validate_call(*args, **kwargs)
+                return pool.submit(fn, context, handler, *args, **kwargs)
+
+            # The pool is sized to the concurrency limit, so handing over
+            # to it is as good as starting.
+            return APIExecutor(submit, api.max_concurrency, track_start=False,
+                               metrics=metrics)
+
+        if api.is_coroutine:
+            def submit(fn, *args, **kwargs):
+                return asyncio.run_coroutine_threadsafe(fn(*args, **kwargs),
+                                                        self.loop)
+            return APIExecutor(submit, api.max_concurrency, metrics=metrics)
+
+        return APIExecutor(self.executor.submit, api.max_concurrency,
+                           metrics=metrics)
+
+    def invalidate_cache(self, *api_names):
+        """
+        Clears cached results of the given APIs (default: all cached APIs),
+        both here and in clients that have invoked them.
+        """
+        if not api_names:
+            api_names = [name for name, api in self.apis.items()
+                         if api.result_cache is not None]
+
+        for name in api_names:
+            api = self.apis.get(name)
+            if api is None or api.result_cache is None:
+                raise BadArguments("Not a cached API: " + str(name))
+
+        for name in api_names:
+            self.apis[name].result_cache.clear()
+
+        with self.cache_cookies_lock:
+            cookies = list(self.cache_cookies)
+
+        for cookie in cookies:
+            self.sender.send({"invalidate": list(api_names)},
+                             headers={"COOKIE": cookie})
+
+    def track_cache_cookie(self, cookie):
+        with self.cache_cookies_lock:
+            self.cache_cookies[cookie] = True
+            self.cache_cookies.move_to_end(cookie)
+            if len(self.cache_cookies) > self.MAX_CACHE_COOKIES:
+                self.cache_cookies.popitem(last=False)
+
+    def queue_length(self):
+        """ Number of invocations waiting to start, across all APIs. """
+        return sum(x.waiting for x in self.api_executors.values())
+
+    def estimated_wait(self, api_executor):
+        """ Estimates how long a new invocation would wait to start. """
+        pool_wait = sum(x.waiting * x.avg_run_time for x in
+                        self.api_executors.values()) / self.MAX_RPC_WORKERS
+        if not api_executor.max_concurrency:
+            return pool_wait
+
+        api_wait = api_executor.waiting * api_executor.avg_run_time / \
+            api_executor.max_concurrency
+        return max(pool_wait, api_wait)
+
+    def stats(self):
+        """
+        Returns a snapshot of the metrics of every API, along with the state
+        of its executor, keyed by API name.
+        """
+        result = {}
+        for name, metrics in self.metrics.items():
+            result[name] = metrics.snapshot()
+            if name in self.api_executors:
+                result[name].update(self.api_executors[name].stats())
+        return result
+
+    def api_stats(self):
+        """
+        Returns queue depth, in-flight count, wait and run times (in seconds)
+        and rejections of every API, keyed by API name.
+        """
+        return {name: executor.stats()
+                for name, executor in self.api_executors.items()}
+
     def get_appmgr_client(self):
         # This is so that RootRPCServer in WeaveServer need not create an
         # RPCClient to itself.
@@ -146,191 +550,908 @@ class RPCServer(RPC):
 
 
     def stop(self):
-        self.appmgr_client["unregister_rpc"](self.name, _block=True)
+        if self.allow_local:
+            with local_servers_lock:
+                local_servers.pop(self.receiver.channel, None)
 
-        self.appmgr_client.stop()
+        if self.appmgr_client is not None:
+            self.appmgr_client["unregister_rpc"](self.name, _block=True)
+            self.appmgr_client.stop()
 
         # TODO: Delete the queue, too.
         self.receiver.stop()
         self.receiver_thread.join()
 
         self.executor.shutdown()
+        for pool in self.process_pools:
+            pool.shutdown()
 
-    def on_rpc_message(self, rpc_obj, headers):
-        def make_done_callback(request_id, cmd, cookie):
-            def callback(future):
-                try:
-                    self.sender.send({
-                        "id": request_id,
-                        "command": cmd,
-                        "result": future.result()
-                    }, headers={"COOKIE": cookie})
-                except WeaveException as e:
-                    logger.warning("WeaveException was raised by API: %s", e)
-                    self.sender.send({
-                        "id": request_id,
-                        "command": cmd,
-                        "error_name": e.err_msg(),
-                        "error": e.extra
-                    }, headers={"COOKIE": cookie})
-                except Exception as e:
-                    logger.exception("Internal API raised exception." + str(e))
-                    self.sender.send({
-                        "id": request_id,
-                        "command": cmd,
-                        "error": "Internal API Error."
-                    }, headers={"COOKIE": cookie})
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.loop_thread.join()
+            self.loop.close()
+        self.response_executor.shutdown()
 
+    def on_rpc_message(self, rpc_obj, headers, send_response=None):
+        cookie = rpc_obj["response_cookie"]
+        rpc_obj["received_at"] = time.time()
+
+        if send_response is None:
+            def send_response(response):
+                self.sender.send(response, headers={"COOKIE": cookie})
+
+        if "stream_ack" in rpc_obj:
+            self.on_stream_ack(cookie, rpc_obj["stream_ack"])
+        elif "batch" in rpc_obj:
+            self.execute_batch(rpc_obj, headers, send_response)
+        elif "call" in rpc_obj:
+            self.execute_invocation(self.expand_call(rpc_obj["call"]),
+                                    rpc_obj, headers, send_response)
+        else:
+            self.execute_invocation(rpc_obj["invocation"], rpc_obj, headers,
+                                    send_response)
+
+    def expand_call(self, call):
+        """ Returns the invocation for a compact call. """
+        index, request_id, values = call
+        api = None
+        if self.api_index is not None and 0 <= index < len(self.api_index):
+            api = self.apis[self.api_index[index]]
+        if api is None:
+            return {"command": None, "id": request_id}
+
+        obj = {"command": api.name, "id": request_id}
+        num_args = len(api.args)
+        if len(values) != num_args + len(api.kwargs):
+            # Fails validation.
+            obj["args"] = values
+            return obj
+        if num_args:
+            obj["args"] = values[:num_args]
+        if api.kwargs:
+            obj["kwargs"] = dict(zip(kwarg_names(api), values[num_args:]))
+        return obj
+
+    def execute_batch(self, rpc_obj, headers, send_response):
+        batch_id = rpc_obj["batch"]["id"]
+        invocations = rpc_obj["batch"]["invocations"]
+        responses = [None] * len(invocations)
+        pending = [len(invocations)]
+        lock = Lock()
+
+        def make_callback(index):
+            def callback(response):
+                with lock:
+                    responses[index] = response
+                    pending[0] -= 1
+                    if pending[0]:
+                        return
+                send_response({"id": batch_id, "batch": responses})
             return callback
 
-        def execute_api_internal(rpc_obj, headers, api, *args, **kwargs):
-            # Keep func name in sync one in get_rpc_caller(..)
-            return api(*args, **kwargs)
+        if not invocations:
+            send_response({"id": batch_id, "batch": []})
+
+        for index, obj in enumerate(invocations):
+            api = self.apis.get(obj["command"])
+            if api is not None and api.streaming:
+                make_callback(index)({
+                    "id": obj["id"],
+                    "error": "Streaming APIs can not be batched."
+                })
+                continue
+            self.execute_invocation(obj, rpc_obj, headers,
+                                    make_callback(index))
+
+    def on_stream_ack(self, cookie, ack):
+        with self.streams_lock:
+            stream = self.streams.get((cookie, ack["id"]))
+        if stream is not None:
+            stream.add_credits(ack["credits"], ack.get("cancel", False))
+
+    def execute_invocation(self, obj, rpc_obj, headers, on_response):
+        def execute_api(context, api, *args, **kwargs):
+            # Invocations may wait behind others before they get to run.
+            if context.expired:
+                raise TimedOut("Deadline exceeded.")
+            return context.run(api, *args, **kwargs)
+
+        async def execute_coroutine(context, api, *args, **kwargs):
+            if context.expired:
+                raise TimedOut("Deadline exceeded.")
+            return await context.run_coroutine(api, *args, **kwargs)
+
+        def make_done_callback(request_id, cmd):
+            def callback(future):
+                on_response(self.build_response(request_id, cmd, future))
+            return callback
+
+        def make_caching_callback(cache, key, callback):
+            generation = cache.generation
+
+            def caching_callback(future):
+                if future.exception() is None:
+                    cache.put(key, future.result(), generation)
+                callback(future)
+            return caching_callback
+
+        def execute_stream(context, stream, api, *args, **kwargs):
+            try:
+                if context.expired:
+                    raise TimedOut("Deadline exceeded.")
+                iterator = context.run(api, *args, **kwargs)
+                try:
+                    for items in chunked(iterate_in_context(context, iterator),
+                                         api.stream_chunk_size):
+                        if not stream.acquire(self.STREAM_ACK_TIMEOUT):
+                            if stream.cancelled:
+                                break
+                            raise TimedOut("Stream acknowledgement timed out.")
+                        if context.expired:
+                            raise TimedOut("Deadline exceeded.")
+                        stream.send(items)
+                finally:
+                    iterator.close()
+                return stream
+            finally:
+                self.close_stream(rpc_obj["response_cookie"], request_id)
+
+        async def execute_async_stream(context, stream, api, *args,
+                                       **kwargs):
+            async def produce():
+                iterator = api(*args, **kwargs)
+                try:
+                    async for items in chunked_async(iterator,
+                                                     api.stream_chunk_size):
+                        if not await stream.acquire_async(
+                                self.STREAM_ACK_TIMEOUT):
+                            if stream.cancelled:
+                                break
+                            raise TimedOut("Stream acknowledgement timed out.")
+                        if context.expired:
+                            raise TimedOut("Deadline exceeded.")
+                        await self.loop.run_in_executor(
+                            self.response_executor, stream.send, items)
+                finally:
+                    await iterator.aclose()
+                return stream
+
+            try:
+                if context.expired:
+                    raise TimedOut("Deadline exceeded.")
+                return await context.run_coroutine(produce)
+            finally:
+                self.close_stream(rpc_obj["response_cookie"], request_id)
 
-        obj = rpc_obj["invocation"]
-        cookie = rpc_obj["response_cookie"]
         request_id = obj["id"]
         cmd = obj["command"]
         try:
             api = self[cmd]
         except KeyError:
-            self.sender.send({
+            on_response({
                 "id": request_id,
                 "result": False,
                 "error": "API not found."
             })
             return
 
+        on_response = self.instrument(cmd, obj, on_response)
+        if api.idempotent:
+            on_response = self.dedupe((rpc_obj["response_cookie"],
+                                       request_id), on_response)
+            if on_response is None:
+                return
+
+        done_callback = make_done_callback(request_id, cmd)
+        if api.result_cache is not None:
+            self.track_cache_cookie(rpc_obj["response_cookie"])
+            key = cache_key(obj)
+            found, result = api.result_cache.get(key)
+            if found:
+                on_response({"id": request_id, "command": cmd,
+                             "result": result})
+                return
+            done_callback = make_caching_callback(api.result_cache, key,
+                                                  done_callback)
+
         args = obj.get("args", [])
         kwargs = obj.get("kwargs", {})
-        future = self.executor.submit(execute_api_internal, rpc_obj, headers,
-                                      api, *args, **kwargs)
-        future.add_done_callback(make_done_callback(request_id, cmd, cookie))
+        # Clients send the time left rather than a deadline, as their clock
+        # may not agree with ours.
+        timeout = rpc_obj.get("timeout")
+        deadline = None if timeout is None else \
+            rpc_obj["received_at"] + timeout
+        context = RequestContext(headers.get("AUTH"), request_id,
+                                 rpc_obj["received_at"], deadline)
+        if context.expired:
+            logger.debug("Skipping expired invocation: %s", request_id)
+            future = Future()
+            future.set_exception(TimedOut("Deadline exceeded."))
+            done_callback(future)
+            return
+
+        api_executor = self.api_executors[cmd]
+        if self.admission_policy is not None:
+            reason = self.admission_policy.check(
+                self.queue_length(), self.estimated_wait(api_executor),
+                context.remaining())
+            if reason is not None:
+                logger.debug("Rejecting invocation %s: %s", request_id,
+                             reason)
+                api_executor.record_rejection()
+                future = Future()
+                future.set_exception(Overloaded(reason))
+                done_callback(future)
+                return
+
+        if api.streaming:
+            stream = self.open_stream(rpc_obj["response_cookie"], request_id,
+                                      cmd, on_response, api.is_coroutine,
+                                      rpc_obj.get("stream_window"))
+            func = execute_async_stream if api.is_coroutine else execute_stream
+            future = api_executor.submit(func, context, stream, api, *args,
+                                         **kwargs)
+        elif api.use_processes:
+            future = api_executor.submit(execute_in_process, context,
+                                         api.handler, *args, **kwargs)
+        elif api.is_coroutine:
+            future = api_executor.submit(execute_coroutine, context, api,
+                                         *args, **kwargs)
+        else:
+            future = api_executor.submit(execute_api, context, api, *args,
+                                         **kwargs)
+
+        if api.is_coroutine:
+            future.add_done_callback(
+                partial(self.response_executor.submit, done_callback))
+        else:
+            future.add_done_callback(done_callback)
+
+    def instrument(self, cmd, obj, on_response):
+        """ Wraps on_response to record metrics of the invocation. """
+        metrics = self.metrics[cmd]
+        sample_sizes = metrics.record_invocation()
+        if sample_sizes:
+            payload = [obj.get("args", []), obj.get("kwargs", {})]
+            metrics.request_size.record(payload_size(payload))
+
+        def send_response(response):
+            if "result" not in response and "stream_seq" not in response:
+                metrics.record_error()
+            elif sample_sizes and "result" in response:
+                metrics.response_size.record(
+                    payload_size(response["result"]))
+
+            start = time.time()
+            on_response(response)
+            metrics.send_time.record(time.time() - start)
+        return send_response
+
+    def open_stream(self, cookie, request_id, cmd, on_response, use_loop,
+                    window):
+        stream = ServerStream(request_id, cmd, on_response,
+                              window or ResponseStream.DEFAULT_WINDOW,
+                              self.loop if use_loop else None)
+        with self.streams_lock:
+            self.streams[(cookie, request_id)] = stream
+        return stream
+
+    def close_stream(self, cookie, request_id):
+        with self.streams_lock:
+            self.streams.pop((cookie, request_id), None)
+
+    def dedupe(self, key, on_response):
+        """
+        Returns the callback to execute the request with, or None if it is a
+        duplicate (by response cookie and request ID) that has been taken
+        care of.
+        """
+        with self.dedupe_lock:
+            found, response = self.recent_responses.get(key)
+            if not found:
+                if key in self.inflight:
+                    self.inflight[key].append(on_response)
+                    return None
+                self.inflight[key] = [on_response]
+
+        if found:
+            on_response(response)
+            return None
+
+        def respond(response):
+            with self.dedupe_lock:
+                callbacks = self.inflight.pop(key, [])
+                # A request that timed out may be retried.
+                if response.get("error_name") != "TimedOut":
+                    self.recent_responses.put(key, response)
+
+            for callback in callbacks:
+                callback(response)
+        return respond
+
+    def build_response(self, request_id, cmd, future):
+        try:
+            result = future.result()
+            if isinstance(result, ServerStream):
+                return {
+                    "id": request_id,
+                    "command": cmd,
+                    "stream_seq": result.seq,
+                    "end": True
+                }
+            return {
+                "id": request_id,
+                "command": cmd,
+                "result": result
+            }
+        except WeaveException as e:
+            logger.warning("WeaveException was raised by API: %s", e)
+            return {
+                "id": request_id,
+                "command": cmd,
+                "error_name": e.err_msg(),
+                "error": e.extra
+            }
+        except Exception as e:
+            logger.exception("Internal API raised exception." + str(e))
+            return {
+                "id": request_id,
+                "command": cmd,
+                "error": "Internal API Error."
+            }
 
     @property
     def info_message(self):
         return {
             "name": self.name,
             "description": self.description,
-            "apis": {name: api.info for name, api in self.apis.items()},
+            "apis": self.api_infos,
             "request_queue": self.receiver.channel,
             "response_queue": self.sender.channel
         }
 
 
 class RPCClient(RPC):
-    def __init__(self, conn, rpc_info, token=None):
+    """
+    timeout is the default for calls that don't pass in _timeout. Calls made
+    from within an RPC handler are also bound by the deadline of the request
+    being handled.
+
+    hedge_policy and retry_policy apply to calls of idempotent APIs, unless
+    overridden by the ClientAPI.
+
+    Responses for all clients on a connection are received by a single
+    ResponseDemux thread, which also runs the callbacks. Callbacks that take
+    long delay the responses of every other client.
+
+    ClientAPIs are built from the RPC info on first use.
+
+    With coalesce=True, concurrent calls to an idempotent API with the same
+    arguments share one request, and all get its response. Calls that join
+    a request already in flight are bound by its deadline, not their own.
+    """
+    def __init__(self, conn, rpc_info, token=None, timeout=None,
+                 hedge_policy=None, retry_policy=None, coalesce=False):
         self.token = token
         name = rpc_info["name"]
         description = rpc_info["description"]
-        apis = [self.get_api_call(x) for x in rpc_info["apis"].values()]
-        super(RPCClient, self).__init__(name, description, apis)
+        super(RPCClient, self).__init__(name, description, [])
+        self.api_infos = rpc_info["apis"]
+        self.apis_lock = Lock()
 
-        self.client_cookie = "rpc-client-cookie-" + str(uuid4())
+        self.demux = get_demux(conn)
+        self.client_cookie = None
+        self.response_queue = rpc_info["response_queue"]
         self.sender = Sender(conn, rpc_info["request_queue"], auth=self.token)
-        self.receiver = RPCReceiver(conn, self, rpc_info["response_queue"],
-                                    cookie=self.client_cookie)
-        self.receiver_thread = Thread(target=self.receiver.run)
 
-        self.callbacks = {}
-        self.callbacks_lock = RLock()
+        self.timeout = timeout
+        self.hedge_policy = hedge_policy
+        self.retry_policy = retry_policy
+        self.pending = PendingCalls()
+        self.coalesce = coalesce
+        self.coalesced = {}
+        self.coalesced_lock = Lock()
 
     def start(self):
         self.sender.start()
-        self.receiver.start()
-        self.receiver_thread.start()
+        self.client_cookie = self.demux.subscribe(self.response_queue, self)
 
     def stop(self):
         self.sender.close()
-        self.receiver.stop()
-        self.receiver_thread.join()
+        self.demux.unsubscribe(self.response_queue, self)
+        self.pending.fail_all("ObjectClosed", "Client stopped.")
 
-    def get_api_call(self, obj):
-        def make_blocking_callback(event, response_arr):
-            def callback(obj):
-                response_arr.append(obj)
-                event.set()
-            return callback
+    def __getitem__(self, name):
+        api = self.apis.get(name)
+        if api is not None:
+            return api
 
-        def on_invoke(obj, block, callback):
-            msg_id = obj["id"]
+        info = self.api_infos[name]
+        with self.apis_lock:
+            if name not in self.apis:
+                self.apis[name] = self.get_api_call(info)
+            return self.apis[name]
+
+    @property
+    def request_schema(self):
+        for name in self.api_infos:
+            self[name]
+        return super(RPCClient, self).request_schema
+
+    @property
+    def pending_count(self):
+        """ Number of calls awaiting a response. """
+        return len(self.pending)
+
+    def get_api_call(self, obj):
+        def make_caching_callback(cache, key, callback):
+            generation = cache.generation
+
+            def caching_callback(response):
+                if "result" in response:
+                    cache.put(key, response["result"], generation)
+                if callback:
+                    callback(response)
+            return caching_callback
+
+        def on_invoke(obj, block, callback, timeout=None):
+            request = self.build_request(api, obj)
+            if api.streaming:
+                return self.open_stream(request, obj["id"], timeout)
+
+            policies = {}
+            if api.idempotent:
+                policies = {
+                    "hedge_policy": api.hedge_policy or self.hedge_policy,
+                    "retry_policy": api.retry_policy or self.retry_policy,
+                }
+
+            cache = api.result_cache
+            coalesce = self.coalesce and api.idempotent
+            if cache is None and not coalesce:
+                response = self.invoke(request, obj["id"], block, callback,
+                                       timeout, **policies)
+                return extract_rpc_payload(response) if block else None
+
+            key = cache_key(obj)
+            if cache is not None:
+                found, result = cache.get(key)
+                if found:
+                    if callback:
+                        callback({"id": obj["id"], "command": obj["command"],
+                                  "result": result})
+                    return result if block else None
 
             if block:
-                res_arr = []
-                event = Event()
-                callback = make_blocking_callback(event, res_arr)
+                future = Future()
+                callback = future.set_result
+            if cache is not None:
+                callback = make_caching_callback(cache, key, callback)
+            if coalesce:
+                self.invoke_coalesced((api.name, key), request, obj["id"],
+                                      callback, timeout, policies)
+            else:
+                self.invoke(request, obj["id"], False, callback, timeout,
+                            **policies)
+            if block:
+                return extract_rpc_payload(self.demux.wait(future))
 
-            if callback:
-                with self.callbacks_lock:
-                    self.callbacks[msg_id] = callback
-
-            self.sender.send({
-                "invocation": obj,
-                "response_cookie": self.client_cookie
-            }, headers={"AUTH": self.token})
-            if not block:
+        api = ClientAPI.from_info(obj, on_invoke)
+        return api
+
+    def invoke_coalesced(self, key, request, msg_id, callback, timeout,
+                         policies):
+        """ Joins the in-flight request with the same key, if any. """
+        with self.coalesced_lock:
+            waiters = self.coalesced.get(key)
+            if waiters is not None:
+                waiters.append((msg_id, callback))
                 return
+            self.coalesced[key] = [(msg_id, callback)]
 
-            event.wait()
-            return extract_rpc_payload(res_arr[0])
+        def on_response(response):
+            with self.coalesced_lock:
+                waiters = self.coalesced.pop(key, [])
+            for waiter_id, waiter in waiters:
+                if waiter:
+                    waiter(dict(response, id=waiter_id))
 
-        return ClientAPI.from_info(obj, on_invoke)
+        try:
+            self.invoke(request, msg_id, False, on_response, timeout,
+                        **policies)
+        except Exception:
+            self.pending.pop(msg_id)
+            with self.coalesced_lock:
+                waiters = self.coalesced.pop(key, [])
+            for waiter_id, waiter in waiters[1:]:
+                if waiter:
+                    waiter(error_response(waiter_id, "InternalError",
+                                          "Unable to send request."))
+            raise
+
+    def build_request(self, api, obj):
+        """ Uses the compact encoding if the server supports it. """
+        if api.index is None:
+            return {"invocation": obj}
+
+        # Request IDs only need to be unique per response cookie.
+        obj["id"] = self.demux.next_request_id()
+        values = obj.get("args", [])
+        kwargs = obj.get("kwargs", {})
+        names = kwarg_names(api)
+        if len(kwargs) != len(names):
+            # Only declared kwargs have a place in a compact call.
+            raise BadArguments("Unexpected keyword arguments.")
+        values = values + [kwargs[name] for name in names]
+        return {"call": [api.index, obj["id"], values]}
+
+    def batch(self):
+        """ Returns an RPCBatch to send several invocations at once. """
+        return RPCBatch(self)
+
+    def invoke(self, request, msg_id, block, callback, timeout=None,
+               hedge_policy=None, retry_policy=None):
+        """
+        Sends the request and registers for the response with msg_id. Returns
+        the raw response if block is True.
+        """
+        if block:
+            future = Future()
+            callback = future.set_result
+
+        request["response_cookie"] = self.client_cookie
+        if callback and (hedge_policy or retry_policy):
+            self.send_with_policies(request, msg_id, callback, timeout,
+                                    hedge_policy, retry_policy)
+        else:
+            self.send_request(request, msg_id, callback,
+                              self.get_deadline(timeout,
+                                                get_request_context()))
+
+        if not block:
+            return
+
+        return self.demux.wait(future)
+
+    def open_stream(self, request, msg_id, timeout):
+        def send_ack(credits, cancel):
+            if cancel:
+                self.pending.pop(msg_id)
+            ack = {"id": msg_id, "credits": credits, "cancel": cancel}
+            self.send({"stream_ack": ack,
+                       "response_cookie": self.client_cookie})
+
+        stream = ResponseStream(msg_id, ResponseStream.DEFAULT_WINDOW,
+                                send_ack, extract_rpc_payload)
+        request["stream_window"] = stream.window
+        self.invoke(request, msg_id, False, stream.on_response, timeout)
+        return stream
+
+    def send(self, request):
+        server = local_servers.get(self.sender.channel)
+        if server is not None and \
+                server.service.get_auth_token() == self.token:
+            server.on_rpc_message(request, {}, self.on_local_response)
+        else:
+            self.sender.send(request, headers={"AUTH": self.token})
+
+    def on_local_response(self, response):
+        self.on_rpc_message(response, {})
+
+    def send_request(self, request, msg_id, callback, deadline):
+        set_timeout(request, deadline)
+        if callback:
+            self.pending.add(msg_id, callback, deadline)
+
+        self.send(request)
+
+    def send_with_policies(self, request, msg_id, callback, timeout,
+                           hedge_policy, retry_policy):
+        # Hedges and retries are sent from other threads, so the request
+        # context (if any) has to be looked up now.
+        context = get_request_context()
+        attempt = [1]
+        sent_at = [0]
+        deadline = [None]
+
+        def send():
+            sent_at[0] = time.time()
+            deadline[0] = self.get_deadline(timeout, context)
+            self.send_request(request, msg_id, on_response, deadline[0])
+            delay = hedge_policy.delay() if hedge_policy else None
+            if delay is not None:
+                for hedge in range(hedge_policy.max_hedges):
+                    scheduler.schedule(sent_at[0] + delay * (hedge + 1),
+                                       resend, send_hedge, attempt[0])
+
+        def send_hedge(hedged_attempt):
+            if attempt[0] == hedged_attempt and msg_id in self.pending:
+                set_timeout(request, deadline[0])
+                self.send(request)
+
+        def on_response(response):
+            if retry_policy is not None and \
+                    attempt[0] < retry_policy.max_attempts and \
+                    response.get("error_name") == "TimedOut":
+                attempt[0] += 1
+                scheduler.schedule(
+                    time.time() + retry_policy.delay(attempt[0] - 1), resend,
+                    send)
+                return
+
+            if hedge_policy is not None and "result" in response:
+                hedge_policy.record(time.time() - sent_at[0])
+            callback(response)
+
+        send()
+
+    def get_deadline(self, timeout, context):
+        """ Returns the deadline of a call made in the given context. """
+        if timeout is None:
+            timeout = self.timeout
+        deadline = None if timeout is None else time.time() + timeout
+
+        if context is not None and context.deadline is not None:
+            if deadline is None or context.deadline < deadline:
+                deadline = context.deadline
+        return deadline
 
     def on_rpc_message(self, msg, headers):
-        with self.callbacks_lock:
-            callback = self.callbacks.pop(msg["id"])
+        if "invalidate" in msg:
+            for name in msg["invalidate"]:
+                api = self.apis.get(name)
+                if api is not None and api.result_cache is not None:
+                    api.result_cache.clear()
+            return
 
+        if "stream_seq" in msg and not msg.get("end"):
+            callback = self.pending.get(msg["id"])
+        else:
+            callback = self.pending.pop(msg["id"])
         if not callback:
             return
 
         callback(msg)
 
 
+class RPCBatch(object):
+    """
+    Collects invocations to be sent to the server in a single message.
+    The server executes them concurrently and replies with a single message.
+
+        batch = client.batch()
+        batch["api1"]("hello", 5, k3=False)
+        batch["api2"]()
+        result1, result2 = batch.execute(block=True)
+    """
+    def __init__(self, client):
+        self.client = client
+        self.invocations = []
+
+    def __getitem__(self, name):
+        api = self.client[name]
+        if api.streaming:
+            raise BadArguments("Streaming APIs can not be batched.")
+
+        def add_invocation(*args, **kwargs):
+            self.invocations.append(api.validate_call(*args, **kwargs))
+
+        return add_invocation
+
+    def __len__(self):
+        return len(self.invocations)
+
+    def execute(self, block=False, callback=None, future=False, timeout=None):
+        """
+        With block=True, returns the results in order of invocation, raising
+        the first error. With future=True, returns a Future for the same. The
+        callback instead receives the raw response, whose "batch" key holds
+        the individual responses for extract_rpc_payload().
+        """
+        batch_id = "batch-" + str(uuid4())
+        request = {"batch": {"id": batch_id, "invocations": self.invocations}}
+        if future:
+            result = Future()
+            callback = future_callback(result, extract_batch_payload)
+            self.client.invoke(request, batch_id, False, callback, timeout)
+            return result
+
+        response = self.client.invoke(request, batch_id, block, callback,
+                                      timeout)
+        if block:
+            return extract_batch_payload(response)
+
+
 def get_rpc_caller():
-    for frame, _, _, func, _, _ in inspect.stack(context=0):
-        if func == 'execute_api_internal':
-            if "headers" not in frame.f_locals:
-                continue
+    context = get_request_context()
+    return context.caller if context is not None else None
+
+
+REGISTRY_RPC_INFO = {
+    "name": "",
+    "description": "",
+    "apis": {
+        "rpc_info": {
+            "name": "rpc_info",
+            "description": "",
+            "args": [
+                {
+                    "name": "app_url",
+                    "description": "",
+                    "schema": {"type": "string"}
+                },
+                {
+                    "name": "rpc_name",
+                    "description": "",
+                    "schema": {"type": "string"}
+                },
+            ]
+        }
+    },
+    "request_queue": "/_system/registry/request",
+    "response_queue": "/_system/registry/response",
+}
+
+
+class RPCResolver(object):
+    """
+    Looks up RPC info from the registry using a single long-lived registry
+    client. Results are cached for ttl seconds. Use get_resolver(..) to get
+    the shared instance for a connection and auth token.
+
+    watch(..) registers a callback(rpc_info) that is invoked whenever the
+    registration of an RPC changes (rpc_info is None once it is gone).
+    """
+    DEFAULT_TTL = 30
+    POLL_INTERVAL = 5
+
+    def __init__(self, conn, token, ttl=DEFAULT_TTL,
+                 poll_interval=POLL_INTERVAL):
+        self.conn = conn
+        self.token = token
+        self.ttl = ttl
+        self.poll_interval = poll_interval
+        self.client = None
+        self.cache = {}
+        self.watchers = {}
+        self.watched_info = {}
+        self.lock = RLock()
+        self.stop_event = Event()
+        self.poll_thread = None
+
+    def get_client(self):
+        with self.lock:
+            if self.client is None:
+                client = RPCClient(self.conn, REGISTRY_RPC_INFO, self.token)
+                client.start()
+                self.client = client
+            return self.client
+
+    def resolve(self, app_url, rpc_name, use_cache=True):
+        key = (app_url, rpc_name)
+        with self.lock:
+            entry = self.cache.get(key)
+        if use_cache and entry is not None and entry[0] > time.monotonic():
+            return entry[1]
+
+        rpc_info = self.get_client()["rpc_info"](app_url, rpc_name,
+                                                 _block=True)
+        with self.lock:
+            self.cache[key] = (time.monotonic() + self.ttl, rpc_info)
+        return rpc_info
+
+    def invalidate(self, app_url=None, rpc_name=None):
+        """ Drops the cached info of the given RPC (default: everything). """
+        with self.lock:
+            if app_url is None:
+                self.cache.clear()
+            else:
+                self.cache.pop((app_url, rpc_name), None)
+
+    def watch(self, app_url, rpc_name, callback):
+        """ Returns the current RPC info, or None if it isn't registered. """
+        key = (app_url, rpc_name)
+        rpc_info = self.lookup(key)
+        with self.lock:
+            self.watchers.setdefault(key, []).append(callback)
+            self.watched_info[key] = rpc_info
+            if self.poll_thread is None:
+                self.poll_thread = Thread(target=self.poll, daemon=True)
+                self.poll_thread.start()
+        return rpc_info
+
+    def unwatch(self, app_url, rpc_name, callback):
+        key = (app_url, rpc_name)
+        with self.lock:
+            callbacks = self.watchers.get(key, [])
+            if callback in callbacks:
+                callbacks.remove(callback)
+            if not callbacks:
+                self.watchers.pop(key, None)
+                self.watched_info.pop(key, None)
+
+    def lookup(self, key):
+        try:
+            return self.resolve(*key, use_cache=False)
+        except WeaveException:
+            self.invalidate(*key)
+            return None
+
+    def poll(self):
+        while not self.stop_event.wait(self.poll_interval):
+            with self.lock:
+                keys = list(self.watchers)
 
-            return frame.f_locals["headers"].get("AUTH")
+            for key in keys:
+                try:
+                    rpc_info = self.lookup(key)
+                except IOError:
+                    return
+
+                with self.lock:
+                    if key not in self.watched_info or \
+                            self.watched_info[key] == rpc_info:
+                        continue
+                    self.watched_info[key] = rpc_info
+                    callbacks = list(self.watchers.get(key, []))
+
+                for callback in callbacks:
+                    try:
+                        callback(rpc_info)
+                    except Exception:
+                        logger.exception("Watch callback failed.")
 
+    def stop(self):
+        self.stop_event.set()
+        if self.poll_thread is not None:
+            self.poll_thread.join()
+            self.poll_thread = None
+            self.stop_event = Event()
+
+        with self.lock:
+            if self.client is not None:
+                self.client.stop()
+                self.client = None
+
+
+resolvers = {}
+resolvers_lock = Lock()
 
-def find_rpc(service, app_url, rpc_name):
-    token = service.get_auth_token()
-    conn = service.get_connection()
-
-    rpc_info = {
-        "name": "",
-        "description": "",
-        "apis": {
-            "rpc_info": {
-                "name": "rpc_info",
-                "description": "",
-                "args": [
-                    {
-                        "name": "app_url",
-                        "description": "",
-                        "schema": {"type": "string"}
-                    },
-                    {
-                        "name": "rpc_name",
-                        "description": "",
-                        "schema": {"type": "string"}
-                    },
-                ]
-            }
-        },
-        "request_queue": "/_system/registry/request",
-        "response_queue": "/_system/registry/response",
-    }
 
-    client = RPCClient(conn, rpc_info, token)
-    client.start()
+def get_resolver(conn, token):
+    with resolvers_lock:
+        key = (conn, token)
+        if key not in resolvers:
+            resolvers[key] = RPCResolver(conn, token)
+            conn.add_close_listener(partial(forget_resolver, key))
+        return resolvers[key]
+
+
+def forget_resolver(key):
+    with resolvers_lock:
+        resolver = resolvers.pop(key, None)
+    if resolver is not None:
+        resolver.stop_event.set()
+
+
+def execute_in_process(context, handler, *args, **kwargs):
+    """ Runs handler in a process pool worker, like RPCServer does. """
+    if context.expired:
+        raise TimedOut("Deadline exceeded.")
+    return context.run(handler, *args, **kwargs)
+
+
+def find_rpc(service, app_url, rpc_name):
+    resolver = get_resolver(service.get_connection(),
+                            service.get_auth_token())
+    return resolver.resolve(app_url, rpc_name)
 
-    res = client["rpc_info"](app_url, rpc_name, _block=True)
-    client.stop()
 
-    return res
+def extract_batch_payload(response):
+    if "batch" not in response:
+        # The whole batch failed, say, because it timed out.
+        extract_rpc_payload(response)
+    return [extract_rpc_payload(x) for x in response["batch"]]
 
 
 def extract_rpc_payload(response):
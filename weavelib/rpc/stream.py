@@ -0,0 +1,185 @@
+"""
+Streaming of results from generator (and async generator) API handlers.
+
+The server sends the items in chunks as separate response messages:
+    {"id": .., "command": .., "stream_seq": 0, "items": [..]}
+    ...
+    {"id": .., "command": .., "stream_seq": N, "end": true}
+
+Flow control is credit based. The server sends no more than `window` chunks
+that the client hasn't acknowledged. The client acknowledges chunks (on the
+request queue) as they are consumed:
+    {"stream_ack": {"id": .., "credits": 2, "cancel": false}}
+"""
+
+import asyncio
+import time
+from collections import deque
+from itertools import islice
+from queue import Queue
+from threading import Condition
+
+from weavelib.exceptions import ProtocolError
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+async def chunked_async(async_iterable, size):
+    chunk = []
+    async for item in async_iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def iterate_in_context(context, iterator):
+    """ Iterates with the generator running in the request context. """
+    while True:
+        try:
+            yield context.run(next, iterator)
+        except StopIteration:
+            return
+
+
+class ServerStream(object):
+    """ Sends chunks of a streaming response as credits allow. """
+
+    def __init__(self, request_id, cmd, on_response, window, loop=None):
+        self.request_id = request_id
+        self.cmd = cmd
+        self.on_response = on_response
+        self.credits = window
+        self.cancelled = False
+        self.seq = 0
+        self.cond = Condition()
+        self.loop = loop
+        self.event = None
+
+    def add_credits(self, credits, cancel=False):
+        with self.cond:
+            self.credits += credits
+            self.cancelled = self.cancelled or cancel
+            self.cond.notify_all()
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.notify_async)
+
+    def notify_async(self):
+        if self.event is not None:
+            self.event.set()
+
+    def acquire(self, timeout):
+        """ Returns False if cancelled, or timed out waiting for credits. """
+        with self.cond:
+            self.cond.wait_for(lambda: self.credits or self.cancelled,
+                               timeout)
+            return self.take_credit()
+
+    async def acquire_async(self, timeout):
+        # Created here, as the event has to be created on the loop.
+        if self.event is None:
+            self.event = asyncio.Event()
+        deadline = time.time() + timeout
+        while True:
+            with self.cond:
+                if self.credits or self.cancelled:
+                    return self.take_credit()
+                self.event.clear()
+
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            try:
+                await asyncio.wait_for(self.event.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+
+    def take_credit(self):
+        if self.cancelled or not self.credits:
+            return False
+        self.credits -= 1
+        return True
+
+    def send(self, items):
+        self.on_response({"id": self.request_id, "command": self.cmd,
+                          "stream_seq": self.seq, "items": items})
+        self.seq += 1
+
+
+class ResponseStream(object):
+    """
+    Iterator over the items of a streaming response. At most `window` chunks
+    are buffered, more are requested as they are consumed.
+
+    Call close() (or use it as a context manager) if the stream isn't going to
+    be exhausted. An abandoned stream keeps its server-side generator (and,
+    for synchronous handlers, one of the RPCServer's workers) busy until the
+    server gives up on it after RPCServer.STREAM_ACK_TIMEOUT seconds.
+    """
+    DEFAULT_WINDOW = 8
+
+    def __init__(self, request_id, window, send_ack, extract_func):
+        self.request_id = request_id
+        self.window = window
+        self.send_ack = send_ack
+        self.extract_func = extract_func
+        self.queue = Queue()
+        self.items = deque()
+        self.next_seq = 0
+        self.unacked = 0
+        self.done = False
+
+    def on_response(self, response):
+        self.queue.put(response)
+
+    def __iter__(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __next__(self):
+        while not self.items:
+            if self.done:
+                raise StopIteration
+            self.read_chunk()
+        return self.items.popleft()
+
+    def read_chunk(self):
+        response = self.queue.get()
+        if "stream_seq" not in response:
+            self.done = True
+            self.extract_func(response)
+            raise ProtocolError("Expected a stream response.")
+
+        if response["stream_seq"] != self.next_seq:
+            self.done = True
+            raise ProtocolError("Unexpected stream sequence number.")
+        self.next_seq += 1
+
+        if response.get("end"):
+            self.done = True
+            return
+
+        self.items.extend(response["items"])
+        self.unacked += 1
+        if self.unacked * 2 >= self.window:
+            self.send_ack(self.unacked, False)
+            self.unacked = 0
+
+    def close(self):
+        if not self.done:
+            self.done = True
+            self.send_ack(0, True)